@@ -0,0 +1,190 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+try:
+    from .key_pool import status_of  # type: ignore
+except ImportError:
+    from key_pool import status_of  # type: ignore
+
+
+_log = logging.getLogger("AIDrawing")
+
+_DEFAULTS = {
+    "window": 100,               # 延迟/结果滑动窗口大小
+    "min_samples": 10,           # 样本不足时使用 initial_timeout
+    "percentile": 0.99,
+    "timeout_factor": 1.5,       # deadline = p99 × factor
+    "initial_timeout": 120.0,
+    "min_timeout": 20.0,
+    "max_timeout": 300.0,
+    "initial_concurrency": 4,
+    "min_concurrency": 1,
+    "max_concurrency": 32,
+    "error_threshold": 0.2,      # 窗口内错误率超过该值即乘性减
+    "decrease_factor": 0.5,
+    "decrease_cooldown": 10.0,   # 两次乘性减之间的最小间隔（秒）
+    "max_queue_wait": 60.0,      # 等待并发槽位的上限（秒）
+}
+
+
+class SlotUnavailable(RuntimeError):
+    pass
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    return isinstance(exc, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(exc).__name__
+
+
+class AdaptiveController:
+    """
+    Per provider/model controller: per-call deadline from the rolling latency distribution
+    and an AIMD concurrency limit driven by the rolling error/429 rate.
+    """
+
+    def __init__(self, name: str, cfg: dict, metrics=None):
+        self.name = name
+        self.cfg = cfg
+        self.metrics = metrics
+        self._latencies: deque[float] = deque(maxlen=int(cfg["window"]))
+        self._outcomes: deque[bool] = deque(maxlen=int(cfg["window"]))  # True = error/throttled
+        self.limit = float(cfg["initial_concurrency"])
+        self.in_flight = 0
+        self.waiting = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+        self._publish()
+
+    def percentile(self, q: float) -> float | None:
+        if not self._latencies:
+            return None
+        data = sorted(self._latencies)
+        idx = min(len(data) - 1, max(0, int(round(q * (len(data) - 1)))))
+        return data[idx]
+
+    def deadline(self) -> float:
+        cfg = self.cfg
+        if len(self._latencies) < int(cfg["min_samples"]):
+            return float(cfg["initial_timeout"])
+        p = self.percentile(float(cfg["percentile"])) or float(cfg["initial_timeout"])
+        return min(float(cfg["max_timeout"]), max(float(cfg["min_timeout"]), p * float(cfg["timeout_factor"])))
+
+    def error_rate(self) -> float:
+        return (sum(self._outcomes) / len(self._outcomes)) if self._outcomes else 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        """``async with ctrl.slot() as deadline:`` — wait for a concurrency slot, then run the call."""
+        async with self._cond:
+            self.waiting += 1
+            try:
+                max_wait = self.cfg["max_queue_wait"]
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.in_flight < max(1, int(self.limit))),
+                    float(max_wait) if max_wait is not None else None,  # None：不限等待（批量 CLI）
+                )
+            except asyncio.TimeoutError:
+                self._count("queue_timeouts")
+                raise SlotUnavailable(f"{self.name} 当前并发已满（limit={int(self.limit)}）")
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+        started = time.monotonic()
+        error: BaseException | None = None
+        deadline = self.deadline()
+        try:
+            yield deadline
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.record(time.monotonic() - started, error, deadline)
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+            self._publish()
+
+    def record(self, latency: float, error: BaseException | None = None, deadline: float | None = None) -> None:
+        cfg = self.cfg
+        if error is None:
+            self._latencies.append(latency)
+            self._outcomes.append(False)
+            # 加性增：每个成功调用增加 1/limit，约等于每一轮满并发 +1
+            self.limit = min(float(cfg["max_concurrency"]), self.limit + 1.0 / max(1.0, self.limit))
+            return
+        code = status_of(error)
+        throttled = code == 429
+        overloaded = throttled or _is_timeout(error) or (isinstance(code, int) and code >= 500)
+        if not overloaded:
+            # 非过载类错误（如 401、模型未返回图片）不影响并发；其耗时不代表生成延迟，不计入窗口
+            self._outcomes.append(False)
+            return
+        if _is_timeout(error):
+            # 截尾样本：真实延迟至少为命中的 deadline。计入后 p99 随超时上升，deadline 随之按 timeout_factor 放大，
+            # 避免提供方整体变慢后 p99 停留在旧值、所有调用持续超时
+            self._latencies.append(max(latency, deadline or 0.0))
+        self._outcomes.append(True)
+        self._count("throttled" if throttled else "errors")
+        now = time.monotonic()
+        if (throttled or self.error_rate() > float(cfg["error_threshold"])) \
+                and now - self._last_decrease >= float(cfg["decrease_cooldown"]):
+            old = self.limit
+            self.limit = max(float(cfg["min_concurrency"]), self.limit * float(cfg["decrease_factor"]))
+            self._last_decrease = now
+            self._count("decreases")
+            _log.info("Adaptive %s: concurrency %.1f -> %.1f (error_rate=%.2f, code=%s)",
+                      self.name, old, self.limit, self.error_rate(), code)
+
+    def _count(self, what: str) -> None:
+        if self.metrics is not None:
+            self.metrics.incr(f"adaptive.{self.name}.{what}")
+
+    def _publish(self) -> None:
+        if self.metrics is None:
+            return
+        p50 = self.percentile(0.5)
+        p99 = self.percentile(0.99)
+        m = self.metrics
+        m.gauge(f"adaptive.{self.name}.limit", round(self.limit, 2))
+        m.gauge(f"adaptive.{self.name}.in_flight", self.in_flight)
+        m.gauge(f"adaptive.{self.name}.deadline_s", round(self.deadline(), 2))
+        m.gauge(f"adaptive.{self.name}.error_rate", round(self.error_rate(), 3))
+        if p50 is not None:
+            m.gauge(f"adaptive.{self.name}.p50_s", round(p50, 3))
+            m.gauge(f"adaptive.{self.name}.p99_s", round(p99, 3))
+
+
+class AdaptiveRegistry:
+    """Lazily creates one AdaptiveController per ``provider/model``."""
+
+    def __init__(self, cfg: dict | None = None, metrics=None):
+        cfg = cfg if isinstance(cfg, dict) else {}
+        self.enabled = bool(cfg.get("enabled", True))
+        self.cfg = {**_DEFAULTS, **{k: v for k, v in cfg.items() if k in _DEFAULTS}}
+        self.metrics = metrics
+        self._controllers: dict[str, AdaptiveController] = {}
+
+    def get(self, provider: str, model: str) -> AdaptiveController:
+        name = f"{provider}/{model}"
+        ctrl = self._controllers.get(name)
+        if ctrl is None:
+            ctrl = AdaptiveController(name, self.cfg, self.metrics)
+            self._controllers[name] = ctrl
+        return ctrl
+
+    def idle(self, provider: str, model: str) -> bool:
+        """True when nothing is running or queued and a background call would still leave a free slot."""
+        ctrl = self._controllers.get(f"{provider}/{model}")
+        if ctrl is None:
+            return True
+        return ctrl.in_flight == 0 and ctrl.waiting == 0 and (not self.enabled or int(ctrl.limit) >= 2)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str):
+        if not self.enabled:
+            yield None
+            return
+        async with self.get(provider, model).slot() as deadline:
+            yield deadline
@@ -0,0 +1,232 @@
+"""
+Bulk image generation from a prompt file, outside of chat.
+
+    python batch.py prompts.jsonl --out-dir renders/stickers --concurrency 4
+    python batch.py prompts.csv --out-dir renders/banners --model google/gemini-2.5-flash-image-preview
+
+Input: JSONL (one ``{"id": ..., "prompt": ..., "model": ...}`` object or bare JSON string per
+line) or CSV with a ``prompt`` column and optional ``id``/``model`` columns. Prompts without
+an id are keyed by a hash of the prompt text and model. Each id is written to ``<id>.png``;
+ids with characters unsafe in file names get a hash suffix, and ids that would still share
+a file name (e.g. differing only in case) are rejected before anything runs.
+
+Uses the plugin's config.json (keys, model, capabilities, adaptive deadlines, fallback).
+Every finished prompt is appended to ``<out-dir>/manifest.jsonl`` right away; re-running
+the same command skips prompts that already succeeded, so a crashed run can be resumed.
+Prompts rendered by the pollinations fallback are recorded with ``status: fallback`` and are
+run again on the next invocation.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import statistics
+from urllib.parse import quote
+
+from settings import load_config, resolve_output_dir
+from key_pool import KeyPool
+from metrics import Metrics
+from adaptive import AdaptiveRegistry
+from get_image import generate_image_result, download_image, warm_up, close_http_client
+
+
+def output_name(job_id: str) -> str:
+    """File name for an id: unsafe characters replaced, plus a hash of the id if any were."""
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in job_id)
+    if safe != job_id or not safe:
+        # 替换过字符的 id（如 a/b 与 a_b）加上原 id 的哈希，避免映射到同一个文件
+        safe = f"{safe}_{hashlib.sha1(job_id.encode('utf-8')).hexdigest()[:8]}"
+    return f"{safe}.png"
+
+
+def read_prompts(path: str) -> list[dict]:
+    items: list[dict] = []
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                items.append({k: (v or "").strip() for k, v in row.items() if k})
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise SystemExit(f"{path}:{lineno}: invalid JSON: {e}")
+                items.append({"prompt": obj} if isinstance(obj, str) else obj)
+    out, seen, files = [], {}, {}
+    for item in items:
+        prompt = str(item.get("prompt") or "").strip()
+        if not prompt:
+            continue
+        model = item.get("model") or None
+        # 同一提示词配不同模型是不同的任务；不带模型时保持旧的哈希，已有 manifest 仍可续跑
+        raw = prompt if model is None else f"{model}\n{prompt}"
+        job_id = str(item.get("id") or hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16])
+        if job_id in seen:
+            if seen[job_id] != (prompt, model):
+                print(f"warning: duplicate id {job_id!r} with a different prompt/model, skipped", file=sys.stderr)
+            continue
+        seen[job_id] = (prompt, model)
+        name = output_name(job_id)
+        # 大小写不敏感的文件系统上只差大小写的文件名也会互相覆盖
+        other = files.setdefault(name.casefold(), job_id)
+        if other != job_id:
+            raise SystemExit(f"{path}: ids {other!r} and {job_id!r} map to the same output file {name}")
+        out.append({"id": job_id, "prompt": prompt, "model": model, "file": name})
+    return out
+
+
+def completed_ids(manifest_path: str) -> set[str]:
+    done: set[str] = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 崩溃时可能留下半行
+            if rec.get("status") == "ok" and rec.get("path") and os.path.exists(rec["path"]):
+                done.add(str(rec.get("id")))
+    return done
+
+
+class Manifest:
+    """Append-only JSONL manifest, flushed and fsync'd per record so a crash loses nothing."""
+
+    def __init__(self, path: str):
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        self._f.close()
+
+
+async def run_one(job: dict, *, cfg: dict, out_dir: str, pool: KeyPool, adaptive: AdaptiveRegistry,
+                  use_fallback: bool) -> dict:
+    openrouter_cfg = cfg.get("openrouter", {}) or {}
+    model = job["model"] or openrouter_cfg.get("model") or "google/gemini-2.5-flash-image-preview:free"
+    caps = (openrouter_cfg.get("model_capabilities") or {}).get(model) or {}
+    out_path = os.path.join(out_dir, job["file"])
+    started = time.monotonic()
+    record = {"id": job["id"], "prompt": job["prompt"], "model": model}
+    try:
+        if not openrouter_cfg.get("enabled", True):
+            raise RuntimeError("openrouter disabled")
+        async with adaptive.slot("openrouter", model) as deadline:
+            result = await generate_image_result(
+                job["prompt"],
+                out_path=out_path,
+                site_url=(openrouter_cfg.get("site_url") or None),
+                site_title=(openrouter_cfg.get("site_title") or None),
+                model=model,
+                key_pool=pool,
+                timeout=deadline,
+                native_image=bool(caps.get("image_output", True)),
+            )
+        record.update(status="ok", provider="openrouter", path=result.path)
+    except Exception as e:
+        record["error"] = str(e)[:300]
+        fallback_cfg = cfg.get("fallback", {}) or {}
+        if use_fallback and fallback_cfg.get("enabled", True):
+            try:
+                path = await download_image("https://image.pollinations.ai/prompt/" + quote(job["prompt"]), out_path)
+                # 单独记为 fallback：续跑时会重新用 OpenRouter 生成
+                record.update(status="fallback", provider="pollinations", path=path)
+            except Exception as fe:
+                record.update(status="error", error=f"{record['error']} | fallback: {fe}"[:300])
+        else:
+            record["status"] = "error"
+    record["latency_s"] = round(time.monotonic() - started, 3)
+    record["ts"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return record
+
+
+def _pct(data: list[float], q: float) -> float:
+    data = sorted(data)
+    return data[min(len(data) - 1, max(0, int(round(q * (len(data) - 1)))))]
+
+
+async def main_async(args) -> int:
+    cfg = load_config(args.config)
+    if args.model:
+        cfg.setdefault("openrouter", {})["model"] = args.model
+    out_dir = os.path.abspath(args.out_dir) if args.out_dir else resolve_output_dir(cfg)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.jsonl")
+
+    jobs = read_prompts(args.input)
+    done = completed_ids(manifest_path)
+    todo = [j for j in jobs if j["id"] not in done]
+    print(f"{len(jobs)} prompts, {len(jobs) - len(todo)} already done, {len(todo)} to run -> {out_dir}")
+    if not todo:
+        return 0
+
+    pool = KeyPool.from_config(cfg)
+    metrics = Metrics()
+    # 排队是本地并发造成的，不应触发回退：批量模式下等待并发槽位不设上限
+    adaptive = AdaptiveRegistry({**(cfg.get("adaptive") or {}), "max_queue_wait": None}, metrics)
+    await warm_up(pool)
+    manifest = Manifest(manifest_path)
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+    latencies: list[float] = []
+    counts = {"ok": 0, "fallback": 0, "error": 0}
+    providers: dict[str, int] = {}
+    started = time.monotonic()
+
+    async def worker(job: dict) -> None:
+        async with sem:
+            rec = await run_one(job, cfg=cfg, out_dir=out_dir, pool=pool, adaptive=adaptive,
+                                use_fallback=not args.no_fallback)
+        manifest.write(rec)
+        counts[rec["status"]] += 1
+        if rec["status"] != "error":
+            latencies.append(rec["latency_s"])
+            providers[rec["provider"]] = providers.get(rec["provider"], 0) + 1
+        finished = sum(counts.values())
+        detail = rec.get("path") if rec["status"] != "error" else rec.get("error")
+        print(f"[{finished}/{len(todo)}] {rec['status']:8} {rec['latency_s']:7.2f}s {rec['id']} {detail}", flush=True)
+
+    try:
+        await asyncio.gather(*(worker(j) for j in todo))
+    finally:
+        manifest.close()
+        await pool.aclose()
+        await close_http_client()
+
+    wall = time.monotonic() - started
+    print("-" * 60)
+    print(f"ok={counts['ok']} fallback={counts['fallback']} error={counts['error']} providers={providers} wall={wall:.1f}s "
+          f"throughput={counts['ok'] / wall * 60 if wall else 0:.2f} img/min")
+    if latencies:
+        print(f"latency mean={statistics.mean(latencies):.2f}s p50={_pct(latencies, 0.5):.2f}s "
+              f"p90={_pct(latencies, 0.9):.2f}s p99={_pct(latencies, 0.99):.2f}s max={max(latencies):.2f}s")
+    print(f"per-key: {json.dumps(pool.snapshot(), ensure_ascii=False)}")
+    return 0 if counts["error"] == 0 and counts["fallback"] == 0 else 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk image generation over generate_image_with_openrouter")
+    parser.add_argument("input", help="prompt file (.jsonl or .csv)")
+    parser.add_argument("--out-dir", help="output directory (default: storage.output_dir from config)")
+    parser.add_argument("--concurrency", type=int, default=4, help="max prompts in flight (default 4)")
+    parser.add_argument("--config", help="config.json to use (default: the plugin's)")
+    parser.add_argument("--model", help="override openrouter.model")
+    parser.add_argument("--no-fallback", action="store_true", help="do not fall back to pollinations")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Measure /p time-to-first-pixel and time-to-full-image through the plugin's own delivery path.
+
+    python bench_preview.py [--side 2048] [--runs 5] [--gen-latency 0] [--max-wait 0] [--mbps 0]
+
+Each run calls ``Fct._run_prompt`` with a fake event context, once with previews off and
+once with previews on, and reports the plugin's ``delivery.first_pixel`` /
+``delivery.full_image`` metrics (mean seconds from the start of generation until
+``send_message`` returned) plus ``delivery.preview_skipped``.
+
+Only the provider call is replaced: a stub returns a synthetic PNG after ``--gen-latency``
+seconds. Thumbnailing, base64 encoding, journaling and sending run as in production.
+``send_message`` returns at once by default; ``--mbps`` makes every send take
+payload/bandwidth seconds, which is a model of the adapter, not a measurement.
+``--max-wait`` is ``preview.max_wait``: how long the full image may be held back for the
+preview. Outside LangBot, minimal stand-ins for the ``pkg`` host modules are installed.
+"""
+import os
+import sys
+import types
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+
+
+def _install_host_stubs() -> None:
+    """Just enough of LangBot's ``pkg`` package to import main.py."""
+    try:
+        import pkg.plugin.context  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    class MessageChain(list):
+        pass
+
+    class Image:
+        def __init__(self, base64=None, url=None, path=None):
+            self.base64, self.url, self.path = base64, url, path
+
+    class Plain:
+        def __init__(self, text):
+            self.text = text
+
+    def _passthrough(*_a, **_k):
+        return lambda obj: obj
+
+    mods = {name: types.ModuleType(name) for name in
+            ("pkg", "pkg.plugin", "pkg.plugin.context", "pkg.plugin.events", "pkg.platform", "pkg.platform.types")}
+    ctx = mods["pkg.plugin.context"]
+    ctx.register = ctx.handler = ctx.llm_func = _passthrough
+    ctx.BasePlugin = type("BasePlugin", (), {})
+    ctx.APIHost = type("APIHost", (), {})
+    ctx.EventContext = type("EventContext", (), {})
+    events = mods["pkg.plugin.events"]
+    events.NormalMessageReceived = type("NormalMessageReceived", (), {})
+    events.NormalMessageResponded = type("NormalMessageResponded", (), {})
+    ptypes = mods["pkg.platform.types"]
+    ptypes.MessageChain, ptypes.Image, ptypes.Plain = MessageChain, Image, Plain
+    sys.modules.update(mods)
+
+
+def _synthetic_png(side: int) -> bytes:
+    import io
+    from PIL import Image as PILImage
+
+    # 噪声图：接近生成图的压缩率，避免纯色图把 PNG 压得过小
+    im = PILImage.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class _FakeContext:
+    """Event context whose send_message optionally models transfer at ``mbps``."""
+
+    def __init__(self, mbps: float):
+        self.mbps = mbps
+        self.event = types.SimpleNamespace(
+            launcher_type="person", launcher_id="bench", sender_id="bench", message_chain=None, query=None,
+        )
+
+    async def send_message(self, target_type, target_id, chain) -> None:
+        size = sum(len(getattr(c, "base64", None) or "") for c in chain)
+        if self.mbps > 0:
+            await asyncio.sleep(size * 8 / (self.mbps * 1e6))
+
+    def add_return(self, key, value) -> None:
+        pass
+
+    def prevent_default(self) -> None:
+        pass
+
+
+async def _run(args) -> None:
+    import main
+    from get_image import ImageResult
+    from journal import JobJournal
+    from metrics import Metrics
+    from preview import ThumbnailWorker
+
+    data = _synthetic_png(args.side)
+    work_dir = tempfile.mkdtemp(prefix="aidrawing-bench-")
+
+    async def fake_generate(prompt, *, out_path, on_image=None, **_kwargs):
+        await asyncio.sleep(args.gen_latency)
+        if on_image is not None:
+            on_image(data)
+        with open(out_path, "wb") as f:
+            f.write(data)
+        return ImageResult(path=out_path, data=data, mime="image/png")
+
+    main.generate_image_result = fake_generate
+    plugin = main.Fct(types.SimpleNamespace())
+    plugin.ap = types.SimpleNamespace(logger=logging.getLogger("bench"))
+    plugin.ready = True
+    plugin.config.setdefault("storage", {})["output_dir"] = work_dir
+    plugin.config.setdefault("openrouter", {})["enabled"] = True
+    plugin._journal = JobJournal(os.path.join(work_dir, "jobs.jsonl"))
+    plugin._cache.enabled = False
+    plugin._image_server = None
+    plugin._preview_platforms = ["*"]
+    plugin._preview_min_bytes = 0
+    plugin._preview_max_wait = args.max_wait
+    worker = ThumbnailWorker()
+    await worker.warm()
+
+    print(f"image: {args.side}x{args.side} PNG, {len(data) / 1e6:.1f} MB; gen latency {args.gen_latency:g}s; "
+          f"max_wait {args.max_wait:g}s; send model: {f'{args.mbps:g} Mbit/s' if args.mbps > 0 else 'instant'}; "
+          f"runs={args.runs}")
+    print("previews   first_pixel    full_image   previews sent/skipped")
+    try:
+        for label, previews in (("off", None), ("on", worker)):
+            plugin._previews = previews
+            plugin.metrics = Metrics()
+            for _ in range(args.runs):
+                await plugin._run_prompt(_FakeContext(args.mbps), "bench", "/p")
+                # 让未等待的预览任务收尾，以免计入下一轮
+                await asyncio.sleep(0.5)
+            m = plugin.metrics
+
+            def mean(what: str) -> str:
+                n = m.get(f"delivery.{what}.count")
+                return f"{m.get(f'delivery.{what}.total_s') / n * 1000:9.1f} ms" if n else "        -   "
+
+            sent, skipped = m.get("delivery.first_pixel.count"), m.get("delivery.preview_skipped")
+            print(f"{label:8s}  {mean('first_pixel')}  {mean('full_image')}   {int(sent)}/{int(skipped)}")
+    finally:
+        worker.shutdown()
+        plugin._journal.close()
+        plugin._shared.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--side", type=int, default=2048)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--gen-latency", type=float, default=0.0, help="seconds the stubbed provider call takes")
+    parser.add_argument("--max-wait", type=float, default=0.0, help="preview.max_wait to benchmark")
+    parser.add_argument("--mbps", type=float, default=0.0, help="model each send at this bandwidth in Mbit/s (0 = instant)")
+    args = parser.parse_args()
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        sys.exit("Pillow is required: pip install Pillow")
+    _install_host_stubs()
+    logging.getLogger("AIDrawing").setLevel(logging.WARNING)
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
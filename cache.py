@@ -0,0 +1,146 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import logging
+
+try:
+    from .get_image import ImageResult  # type: ignore
+    from .image_input import sniff_mime  # type: ignore
+except ImportError:
+    from get_image import ImageResult  # type: ignore
+    from image_input import sniff_mime  # type: ignore
+
+
+_log = logging.getLogger("AIDrawing")
+
+
+class GenerationCache:
+    """
+    Result cache with in-flight deduplication on top of a shared ``Backend``.
+
+    Identical requests in this process await the same future; across processes the first
+    one to ``claim`` the key generates while the others poll the shared cache for its result.
+    Cached entries point at image files on disk, so processes share generations as long as
+    they can read each other's output directories.
+
+    Disabled (the default) every call generates a new image: no lookup, no store, no dedup.
+    """
+
+    def __init__(self, backend, *, enabled: bool = False, ttl: float = 86400.0, wait_timeout: float = 300.0,
+                 poll_interval: float = 0.5, metrics=None):
+        self.backend = backend
+        self.enabled = enabled
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def key(model: str, prompt: str, native_image: bool = True) -> str:
+        raw = f"{model}\n{int(bool(native_image))}\n{prompt.strip()}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.incr(f"cache.{name}")
+
+    def lookup(self, key: str) -> tuple[ImageResult, dict] | None:
+        """Cached result (bytes read from disk) and its metadata, or None."""
+        if not self.enabled:
+            return None
+        try:
+            entry = self.backend.cache_get(key)
+        except Exception as e:
+            _log.warning("Cache lookup failed: %s", e)
+            return None
+        if not entry or not os.path.exists(entry.get("path") or ""):
+            return None
+        with open(entry["path"], "rb") as f:
+            data = f.read()
+        return ImageResult(path=entry["path"], data=data, mime=entry.get("mime") or sniff_mime(data)), entry
+
+    def contains(self, key: str) -> bool:
+        """Like ``lookup`` but without reading the image file."""
+        if not self.enabled:
+            return False
+        try:
+            entry = self.backend.cache_get(key)
+        except Exception:
+            return False
+        return bool(entry) and os.path.exists(entry.get("path") or "")
+
+    def store(self, key: str, result: ImageResult, **meta) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.backend.cache_put(key, {"path": result.path, "mime": result.mime, **meta}, self.ttl)
+        except Exception as e:
+            _log.warning("Cache store failed: %s", e)
+
+    def _claim(self, key: str) -> bool:
+        """共享后端不可用（如 SQLite 锁超时、Redis 宕机）时视为已取得 claim，在本进程生成"""
+        try:
+            return self.backend.claim(key, self.owner, self.wait_timeout)
+        except Exception as e:
+            _log.warning("Cache claim failed, generating locally: %s", e)
+            self._count("backend_errors")
+            return True
+
+    async def _wait_remote(self, key: str) -> tuple[ImageResult, dict] | None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            hit = self.lookup(key)
+            if hit is not None:
+                return hit
+            # 对方放弃/失败（claim 已释放或过期）时由本进程接手
+            if self._claim(key):
+                return None
+        return None
+
+    async def get_or_generate(self, key: str, produce, **meta) -> tuple[ImageResult, bool]:
+        """Return ``(result, from_cache)``; ``produce`` is an async callable run on a miss."""
+        if not self.enabled:
+            return await produce(), False
+        hit = self.lookup(key)
+        if hit is not None:
+            self._count("hits")
+            if hit[1].get("prefetched") and self.metrics is not None:
+                self.metrics.incr("prefetch.hits")
+            return hit[0], True
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._count("dedup_local")
+            return await asyncio.shield(pending), True
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            if not self._claim(key):
+                self._count("dedup_remote")
+                hit = await self._wait_remote(key)
+                if hit is not None:
+                    fut.set_result(hit[0])
+                    return hit[0], True
+            self._count("misses")
+            result = await produce()
+            self.store(key, result, **meta)
+            fut.set_result(result)
+            return result, False
+        except BaseException as e:
+            if not fut.done():
+                fut.set_exception(e)
+                fut.exception()  # 无人等待时避免 "exception was never retrieved"
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            try:
+                self.backend.release(key, self.owner)
+            except Exception as e:
+                # claim 会在 wait_timeout 后自然过期
+                _log.warning("Cache release failed: %s", e)
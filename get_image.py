@@ -1,13 +1,38 @@
 import os
 import base64
-import httpx
+import random
+import asyncio
 import logging
+import importlib
 from pathlib import Path
 import json
 import re
+from dataclasses import dataclass
+from typing import Callable
+
+try:
+    from .key_pool import KeyPool, KeyState, mask_key, resolve_keys, status_of, is_transient  # type: ignore
+    from .image_input import sniff_mime  # type: ignore
+except ImportError:
+    from key_pool import KeyPool, KeyState, mask_key, resolve_keys, status_of, is_transient  # type: ignore
+    from image_input import sniff_mime  # type: ignore
 
 
 _logger = None
+_http_client = None
+
+# Heavy modules imported lazily; warm_up() pulls them in off the event loop
+_WARM_IMPORTS = ("httpx", "openai", "aiofiles")
+
+# 5xx/连接错误的重试次数（与 SDK 默认的 max_retries 相同）
+TRANSIENT_RETRIES = 2
+
+
+@dataclass
+class ImageResult:
+    path: str
+    data: bytes
+    mime: str = "image/png"
 
 
 def _safe_path(path: str) -> str:
@@ -41,23 +66,64 @@ def _get_logger() -> logging.Logger:
     return logger
 
 
+def get_http_client():
+    """Shared keep-alive client for image downloads (built on first use or by warm_up); also used for reference images."""
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0), follow_redirects=True)
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared download client (plugin unload / CLI exit)."""
+    global _http_client
+    client, _http_client = _http_client, None
+    if client is not None:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+async def warm_up(key_pool: KeyPool | None = None, *, preconnect: bool = True) -> None:
+    """
+    Pre-import the SDK, build the pooled clients and (optionally) open a connection per key,
+    so the first generation after a restart does not pay import, construction and TLS costs.
+    """
+    log = _get_logger()
+    loop = asyncio.get_running_loop()
+    for name in _WARM_IMPORTS:
+        try:
+            await loop.run_in_executor(None, importlib.import_module, name)
+        except ImportError as e:
+            log.warning("Warm-up could not import %s: %s", name, e)
+    try:
+        get_http_client()
+        if key_pool is not None:
+            await key_pool.warm_up(preconnect=preconnect)
+    except ImportError as e:
+        # 依赖缺失时跳过预热，首次调用时再报出具体错误
+        log.warning("Warm-up skipped, dependency missing: %s", e)
+
+
 async def download_image(url: str, out_path: str = "drawertemp.png") -> str:
     """Download image from a URL to out_path and return the path."""
     log = _get_logger()
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        content = response.content
-        import aiofiles
-        async with aiofiles.open(out_path, 'wb') as f:
-            await f.write(content)
+    response = await get_http_client().get(url)
+    response.raise_for_status()
+    content = response.content
+    import aiofiles
+    async with aiofiles.open(out_path, 'wb') as f:
+        await f.write(content)
     # 如果传入的已经是绝对路径，直接返回，否则使用 abspath
     final_path = out_path if os.path.isabs(out_path) else os.path.abspath(out_path)
     log.debug(f"Downloaded image to {final_path} from {url}")
     return final_path
 
 
-async def generate_image_with_openrouter(
+async def generate_image_result(
     prompt: str,
     *,
     out_path: str = "drawertemp.png",
@@ -66,11 +132,35 @@ async def generate_image_with_openrouter(
     model: str = "google/gemini-2.5-flash-image-preview:free",
     api_key: str | None = None,
     size: str | None = "1024x1024",
-) -> str:
+    key_pool: KeyPool | None = None,
+    input_images: list[str] | None = None,
+    timeout: float | None = None,
+    native_image: bool = True,
+    on_image: Callable[[bytes], None] | None = None,
+) -> ImageResult:
     """
     Generate an image using OpenRouter's API with Gemini 2.5 Flash Image Preview model.
 
-    Returns absolute path to the saved image file.
+    When ``key_pool`` is given the call is made with a key leased from it (least in-flight,
+    401/429 keys cooled down); otherwise a single key is resolved from ``api_key``/env/config.json.
+    A 401/429 is retried at once on another key; a 5xx or connection error is retried up to
+    ``TRANSIENT_RETRIES`` times with backoff, preferring a key not tried yet.
+
+    ``input_images`` (``data:`` URIs or http URLs) switches to edit/variation mode: they are
+    sent alongside the prompt as multimodal ``image_url`` parts.
+
+    ``timeout`` is a per-call deadline (seconds) applied to each provider request instead of
+    the SDK default.
+
+    ``native_image`` requests the image output modality and reads the structured image parts
+    of the reply. Set it to False for models without image output: they get the legacy
+    "reply with a data URI" prompt, text scanning and the Responses API fallback.
+
+    ``on_image`` is called synchronously with the raw image bytes as soon as they arrive,
+    before they are written to disk; it must not block (schedule a task for async work).
+
+    Returns an ImageResult with the absolute path of the saved file plus the image bytes and
+    MIME type, so callers can deliver the image without reading the file back.
     """
     log = _get_logger()
     
@@ -83,52 +173,35 @@ async def generate_image_with_openrouter(
     except Exception as e:
         log.warning(f"Failed to create directory for {out_path}: {e}")
     
-    from openai import OpenAI
-
-    env_key = os.getenv("OPENROUTER_API_KEY")
-    effective_key = api_key or env_key
-    # Fallback: read from local config.json if still missing
-    if not effective_key:
-        try:
-            base_dir = Path(__file__).parent
-        except Exception:
-            base_dir = Path(os.getcwd())
-        cfg_path = base_dir / "config.json"
-        def _pick_key(d: dict | None):
-            if not isinstance(d, dict):
-                return None
-            for _k in ("api_key", "apikey", "apiKey", "key", "token", "OPENROUTER_API_KEY"):
-                _v = d.get(_k)
-                if isinstance(_v, str) and _v.strip():
-                    return _v.strip()
-            return None
-        try:
-            if cfg_path.exists():
-                import json as _json
-                cfg = _json.loads(cfg_path.read_text(encoding="utf-8"))
-                effective_key = _pick_key(cfg.get("openrouter")) or _pick_key(cfg) or effective_key
-                if effective_key:
-                    log.info("Resolved API key from local config.json at %s", cfg_path)
-        except Exception as _e:
-            log.debug("Failed to read local config.json for API key: %s", _e)
-    def _mask(k: str | None) -> str:
-        if not k:
-            return "<empty>"
-        if len(k) <= 8:
-            return f"{k[0]}***{k[-1]}"
-        return f"{k[:4]}***{k[-4:]} (len={len(k)})"
-    log.debug(
-        "OpenRouter key resolution: passed=%s, env=%s, effective=%s",
-        _mask(api_key), _mask(env_key), _mask(effective_key),
-    )
-    if not effective_key:
-        log.warning("No OpenRouter API key available. Set openrouter.api_key or OPENROUTER_API_KEY")
-        raise RuntimeError("OPENROUTER_API_KEY is not set in environment")
-
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=effective_key,
-    )
+    pool = key_pool
+    owns_pool = False
+    if pool is None or not len(pool):
+        env_key = os.getenv("OPENROUTER_API_KEY")
+        effective_key = api_key or env_key
+        # Fallback: read from local config.json if still missing
+        if not effective_key:
+            try:
+                base_dir = Path(__file__).parent
+            except Exception:
+                base_dir = Path(os.getcwd())
+            cfg_path = base_dir / "config.json"
+            try:
+                if cfg_path.exists():
+                    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+                    effective_key = next(iter(resolve_keys(cfg)), None)
+                    if effective_key:
+                        log.info("Resolved API key from local config.json at %s", cfg_path)
+            except Exception as _e:
+                log.debug("Failed to read local config.json for API key: %s", _e)
+        log.debug(
+            "OpenRouter key resolution: passed=%s, env=%s, effective=%s",
+            mask_key(api_key), mask_key(env_key), mask_key(effective_key),
+        )
+        if not effective_key:
+            log.warning("No OpenRouter API key available. Set openrouter.api_key or OPENROUTER_API_KEY")
+            raise RuntimeError("OPENROUTER_API_KEY is not set in environment")
+        pool = KeyPool([effective_key])
+        owns_pool = True
 
     # Prefer Responses API with explicit image modality; fall back to chat.
     headers = {}
@@ -137,6 +210,29 @@ async def generate_image_with_openrouter(
     if site_title:
         headers["X-Title"] = site_title
 
+    written: dict = {}
+
+    def _write_image(data: bytes) -> str:
+        """Persist the image to out_path and keep the bytes for the returned ImageResult."""
+        if on_image is not None:
+            # 先交给回调（如生成预览图），再落盘
+            try:
+                on_image(data)
+            except Exception as _e:
+                log.debug("on_image callback failed: %s", _e)
+        with open(out_path, "wb") as f:
+            f.write(data)
+        written["data"] = data
+        return _safe_path(out_path)
+
+    async def _download(url: str) -> str:
+        response = await get_http_client().get(url)
+        response.raise_for_status()
+        _write_image(response.content)
+        final_path = _safe_path(out_path)
+        log.debug(f"Downloaded image to {final_path} from {url}")
+        return final_path
+
     def _to_plain(obj):
         try:
             if hasattr(obj, "model_dump"):
@@ -166,7 +262,7 @@ async def generate_image_with_openrouter(
                 # non-iterable leaf
                 continue
 
-    async def _save_from_any(obj) -> str | None:
+    async def _save_from_any(obj, *, scan_text: bool = True) -> str | None:
         plain = _to_plain(obj)
         # 1) Look for explicit image fields first (b64 or URL)
         for node in _iter_nodes(plain):
@@ -178,7 +274,7 @@ async def generate_image_with_openrouter(
                 # Direct string URL
                 if isinstance(img, str) and img.startswith("http"):
                     log.info(f"Downloading image from URL (string): {img}")
-                    return await download_image(img, out_path)
+                    return await _download(img)
                 if isinstance(img, dict):
                     # Base64 variants
                     for k in ("b64_json", "b64", "base64", "data"):
@@ -191,8 +287,7 @@ async def generate_image_with_openrouter(
                                     if comma != -1:
                                         b64v = b64v[comma + 1 :]
                                 data = base64.b64decode(b64v)
-                                with open(out_path, "wb") as f:
-                                    f.write(data)
+                                _write_image(data)
                                 final_path = _safe_path(out_path)
                                 log.info(f"Saved image b64 to {final_path}")
                                 return final_path
@@ -210,8 +305,7 @@ async def generate_image_with_openrouter(
                                         if comma != -1:
                                             b64v = b64v[comma + 1 :]
                                     data = base64.b64decode(b64v)
-                                    with open(out_path, "wb") as f:
-                                        f.write(data)
+                                    _write_image(data)
                                     final_path = _safe_path(out_path)
                                     log.info(f"Saved image b64 (source) to {final_path}")
                                     return final_path
@@ -220,20 +314,19 @@ async def generate_image_with_openrouter(
                         url = src.get("url")
                         if isinstance(url, str) and url.startswith("http"):
                             log.info(f"Downloading image from URL (source): {url}")
-                            return await download_image(url, out_path)
+                            return await _download(url)
                     # URL variants
                     url = img.get("url") or img.get("image_url") or img.get("link")
                     if isinstance(url, str):
                         if url.startswith("http"):
                             log.info(f"Downloading image from URL: {url}")
-                            return await download_image(url, out_path)
+                            return await _download(url)
                         if url.startswith("data:image"):
                             try:
                                 comma = url.find(",")
                                 if comma != -1:
                                     b64v = url[comma + 1 :]
-                                    with open(out_path, "wb") as f:
-                                        f.write(base64.b64decode(b64v))
+                                    _write_image(base64.b64decode(b64v))
                                     abs_path = os.path.abspath(out_path)
                                     log.info(f"Saved image from data URI (url field) to {abs_path}")
                                     return abs_path
@@ -244,7 +337,7 @@ async def generate_image_with_openrouter(
                 url = node["url"]
                 if url.startswith("http"):
                     log.info(f"Downloading image from URL: {url}")
-                    return await download_image(url, out_path)
+                    return await _download(url)
             # Attachments style: {attachments:[{mime_type, url, data}]}
             if isinstance(node.get("attachments"), list):
                 for att in node.get("attachments"):
@@ -262,8 +355,7 @@ async def generate_image_with_openrouter(
                                         if comma != -1:
                                             b64v = b64v[comma + 1 :]
                                     data = base64.b64decode(b64v)
-                                    with open(out_path, "wb") as f:
-                                        f.write(data)
+                                    _write_image(data)
                                     final_path = _safe_path(out_path)
                                     log.info(f"Saved image b64 (attachment) to {final_path}")
                                     return final_path
@@ -272,9 +364,12 @@ async def generate_image_with_openrouter(
                         u = att.get("url") or att.get("image_url")
                         if isinstance(u, str) and u.startswith("http"):
                             log.info(f"Downloading image from URL (attachment): {u}")
-                            return await download_image(u, out_path)
+                            return await _download(u)
 
-        # 2) Check message content string(s) for data URL or http URL
+        if not scan_text:
+            return None
+
+        # 2) Check message content string(s) for data URL or http URL (legacy text replies)
         try:
             # Accept assistant message content in both string and parts array forms
             if isinstance(obj, dict):
@@ -288,8 +383,7 @@ async def generate_image_with_openrouter(
             data_uri_match = re.search(r"data:image/(png|jpe?g|webp|gif);base64,([A-Za-z0-9+/=]+)", s, flags=re.IGNORECASE)
             if data_uri_match:
                 img_bytes = base64.b64decode(data_uri_match.group(2))
-                with open(out_path, "wb") as f:
-                    f.write(img_bytes)
+                _write_image(img_bytes)
                 final_path = _safe_path(out_path)
                 log.info(f"Saved image from data URI to {final_path}")
                 return final_path
@@ -307,7 +401,7 @@ async def generate_image_with_openrouter(
             # If a URL was detected, try download here
             url_match = re.search(r"https?://\S+", content_val)
             if url_match:
-                return await download_image(url_match.group(0), out_path)
+                return await _download(url_match.group(0))
         elif isinstance(content_val, list):
             for part in content_val:
                 if isinstance(part, dict):
@@ -316,20 +410,19 @@ async def generate_image_with_openrouter(
                         v = part.get("image_url") or part.get("image")
                         # direct string
                         if isinstance(v, str) and v.startswith("http"):
-                            return await download_image(v, out_path)
+                            return await _download(v)
                         # object with url
                         if isinstance(v, dict):
                             url = v.get("url") or v.get("image_url") or v.get("link")
                             if isinstance(url, str):
                                 if url.startswith("http"):
-                                    return await download_image(url, out_path)
+                                    return await _download(url)
                                 if url.startswith("data:image"):
                                     try:
                                         comma = url.find(",")
                                         if comma != -1:
                                             b64v = url[comma + 1 :]
-                                            with open(out_path, "wb") as f:
-                                                f.write(base64.b64decode(b64v))
+                                            _write_image(base64.b64decode(b64v))
                                             return _safe_path(out_path)
                                     except Exception as _e:
                                         log.debug("Part url data URI decode failed: %s", _e)
@@ -338,7 +431,7 @@ async def generate_image_with_openrouter(
                             if src:
                                 url = src.get("url")
                                 if isinstance(url, str) and url.startswith("http"):
-                                    return await download_image(url, out_path)
+                                    return await _download(url)
                                 for k in ("b64_json", "b64", "base64", "data"):
                                     b64v = src.get(k)
                                     if isinstance(b64v, str) and len(b64v) > 64:
@@ -347,8 +440,7 @@ async def generate_image_with_openrouter(
                                                 comma = b64v.find(",")
                                                 if comma != -1:
                                                     b64v = b64v[comma + 1 :]
-                                            with open(out_path, "wb") as f:
-                                                f.write(base64.b64decode(b64v))
+                                            _write_image(base64.b64decode(b64v))
                                             return _safe_path(out_path)
                                         except Exception as _e:
                                             log.debug("Part source base64 decode failed: %s", _e)
@@ -359,107 +451,216 @@ async def generate_image_with_openrouter(
                             return maybe
                         u = re.search(r"https?://\S+", txt)
                         if u:
-                            return await download_image(u.group(0), out_path)
+                            return await _download(u.group(0))
 
         return None
 
-    # First attempt: chat.completions mirroring the simple sample flow
-    log.debug(f"Calling OpenRouter Chat Completions model={model}, headers={(list(headers.keys()) or None)}")
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are an image generator. Return exactly one data URI in the form "
-                    "data:image/png;base64,<BASE64>. Do not include any extra text."
-                ),
-            },
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.8,
-        max_tokens=4000,
-        extra_headers=headers or None,
-    )
-    # Try to parse structured parts first
-    try:
-        msg = completion.choices[0].message
-    except Exception:
-        msg = None
-    if msg is not None:
-        saved = await _save_from_any(_to_plain(msg))
-        if isinstance(saved, str):
-            return saved
-
-    # Last resort: treat message content as plain text
-    content = (getattr(getattr(completion.choices[0], "message", {}), "content", "") or "")
-    if isinstance(content, str):
-        log.debug("OpenRouter raw content length=%d", len(content))
-        # Match any image mime-type like the official sample (broader than png/jpeg)
-        data_uri_match = re.search(r"data:image/[^;]+;base64,([A-Za-z0-9+/=]+)", content, flags=re.IGNORECASE)
-        if data_uri_match:
-            img_bytes = base64.b64decode(data_uri_match.group(1))
-            with open(out_path, "wb") as f:
-                f.write(img_bytes)
-            final_path = _safe_path(out_path)
-            log.info(f"Saved image from data URI to {final_path}")
-            return final_path
-        url_match = re.search(r"https?://\S+", content)
-        if url_match:
-            url = url_match.group(0)
-            log.info(f"Downloading image from URL: {url}")
-            return await download_image(url, out_path)
-
-    # Second attempt: Responses API with image modality (as a fallback)
-    try:
-        log.debug(f"Calling OpenRouter Responses API model={model}, headers={(list(headers.keys()) or None)} size={size}")
-        responses = getattr(client, "responses", None)
-        if responses is not None and hasattr(responses, "create"):
-            # Simpler input to align with generic examples
-            resp = responses.create(
+    if input_images:
+        user_content = [{"type": "text", "text": prompt}] + [
+            {"type": "image_url", "image_url": {"url": u}} for u in input_images
+        ]
+        responses_input = [{
+            "role": "user",
+            "content": [{"type": "input_text", "text": prompt}]
+            + [{"type": "input_image", "image_url": u} for u in input_images],
+        }]
+    else:
+        user_content = prompt
+        responses_input = prompt
+
+    # 仅在给定时传入：openai SDK 将 timeout=None 视为不限时
+    call_opts = {"timeout": timeout} if timeout else {}
+
+    def _note_remaining(state: KeyState, raw) -> None:
+        try:
+            _remaining = raw.headers.get("x-ratelimit-remaining")
+            if _remaining is not None:
+                state.remaining = float(_remaining)
+        except Exception:
+            pass
+
+    def _no_image(completion, content) -> str:
+        """If no image is found, dump compact JSON for debugging and surface an error."""
+        try:
+            debug_obj = _to_plain(completion)
+            debug_txt = json.dumps(debug_obj, ensure_ascii=False)[:200]
+        except Exception:
+            debug_txt = (content if isinstance(content, str) else "")[:200]
+        log.warning("Model did not return an image. First 200 chars: %s", debug_txt)
+        # Persist full response for troubleshooting
+        try:
+            base_dir = Path(__file__).parent if Path(__file__).exists() else Path(os.getcwd())
+            dbg_path = base_dir / "logs" / "last_openrouter_response.json"
+            dbg_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(dbg_path, "w", encoding="utf-8") as f:
+                try:
+                    json.dump(_to_plain(completion), f, ensure_ascii=False)
+                except Exception:
+                    f.write(str(completion))
+            log.info("Saved debug response to %s", dbg_path)
+        except Exception:
+            pass
+        raise RuntimeError(f"模型未返回图片，返回内容: {debug_txt}...")
+
+    async def _attempt(state: KeyState) -> str:
+        client = state.client
+        content = ""
+        if native_image:
+            # Native image output: ask for the image modality and read the structured
+            # message.images / image parts; no data-URI-in-text prompt, no token cap to overflow.
+            log.debug(f"Calling OpenRouter Chat Completions (image modality) model={model}, headers={(list(headers.keys()) or None)}")
+            raw = await client.chat.completions.with_raw_response.create(
                 model=model,
-                input=prompt,
-                modalities=["image"],
+                messages=[{"role": "user", "content": user_content}],
+                extra_body={"modalities": ["image", "text"]},
                 extra_headers=headers or None,
-                extra_body={"image": {"size": size}} if size else None,
-                max_output_tokens=4000,
-                temperature=0.8,
+                **call_opts,
             )
-            saved = await _save_from_any(resp)
+            _note_remaining(state, raw)
+            completion = raw.parse()
+            try:
+                msg = completion.choices[0].message
+            except Exception:
+                msg = None
+            if msg is not None:
+                saved = await _save_from_any(_to_plain(msg), scan_text=False)
+                if isinstance(saved, str):
+                    return saved
+            return _no_image(completion, content)
+
+        # Legacy: models without image output are asked for a data URI in the text reply
+        log.debug(f"Calling OpenRouter Chat Completions model={model}, headers={(list(headers.keys()) or None)}")
+        raw = await client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "You are an image generator. Return exactly one data URI in the form "
+                        "data:image/png;base64,<BASE64>. Do not include any extra text."
+                    ),
+                },
+                {"role": "user", "content": user_content},
+            ],
+            temperature=0.8,
+            max_tokens=4000,
+            extra_headers=headers or None,
+            **call_opts,
+        )
+        _note_remaining(state, raw)
+        completion = raw.parse()
+        # Try to parse structured parts first
+        try:
+            msg = completion.choices[0].message
+        except Exception:
+            msg = None
+        if msg is not None:
+            saved = await _save_from_any(_to_plain(msg))
             if isinstance(saved, str):
                 return saved
-            # Broad regex over the entire response JSON as last-ditch
-            try:
-                plain = _to_plain(resp)
-                txt = json.dumps(plain, ensure_ascii=False)
-                m = re.search(r"data:image/[^;]+;base64,([A-Za-z0-9+/=]+)", txt, flags=re.IGNORECASE)
-                if m:
-                    with open(out_path, "wb") as f:
-                        f.write(base64.b64decode(m.group(1)))
-                    return _safe_path(out_path)
-            except Exception as _e:
-                log.debug("Responses JSON scan failed: %s", _e)
-    except Exception as e:
-        log.debug("Responses API call failed: %s", e)
 
-    # If no image is found, dump compact JSON for debugging and surface an error
-    try:
-        debug_obj = _to_plain(completion)
-        debug_txt = json.dumps(debug_obj, ensure_ascii=False)[:200]
-    except Exception:
-        debug_txt = (content if isinstance(content, str) else "")[:200]
-    log.warning("Model did not return an image. First 200 chars: %s", debug_txt)
-    # Persist full response for troubleshooting
+        # Last resort: treat message content as plain text
+        content = (getattr(getattr(completion.choices[0], "message", {}), "content", "") or "")
+        if isinstance(content, str):
+            log.debug("OpenRouter raw content length=%d", len(content))
+            # Match any image mime-type like the official sample (broader than png/jpeg)
+            data_uri_match = re.search(r"data:image/[^;]+;base64,([A-Za-z0-9+/=]+)", content, flags=re.IGNORECASE)
+            if data_uri_match:
+                img_bytes = base64.b64decode(data_uri_match.group(1))
+                _write_image(img_bytes)
+                final_path = _safe_path(out_path)
+                log.info(f"Saved image from data URI to {final_path}")
+                return final_path
+            url_match = re.search(r"https?://\S+", content)
+            if url_match:
+                url = url_match.group(0)
+                log.info(f"Downloading image from URL: {url}")
+                return await _download(url)
+
+        # Second attempt: Responses API with image modality (as a fallback)
+        try:
+            log.debug(f"Calling OpenRouter Responses API model={model}, headers={(list(headers.keys()) or None)} size={size}")
+            responses = getattr(client, "responses", None)
+            if responses is not None and hasattr(responses, "create"):
+                # Simpler input to align with generic examples
+                resp = await responses.create(
+                    model=model,
+                    input=responses_input,
+                    modalities=["image"],
+                    extra_headers=headers or None,
+                    extra_body={"image": {"size": size}} if size else None,
+                    max_output_tokens=4000,
+                    temperature=0.8,
+                    **call_opts,
+                )
+                saved = await _save_from_any(resp)
+                if isinstance(saved, str):
+                    return saved
+                # Broad regex over the entire response JSON as last-ditch
+                try:
+                    plain = _to_plain(resp)
+                    txt = json.dumps(plain, ensure_ascii=False)
+                    m = re.search(r"data:image/[^;]+;base64,([A-Za-z0-9+/=]+)", txt, flags=re.IGNORECASE)
+                    if m:
+                        _write_image(base64.b64decode(m.group(1)))
+                        return _safe_path(out_path)
+                except Exception as _e:
+                    log.debug("Responses JSON scan failed: %s", _e)
+        except Exception as e:
+            log.debug("Responses API call failed: %s", e)
+
+        return _no_image(completion, content)
+
+    loop = asyncio.get_running_loop()
+    # 整体上限：原生模式一次调用；旧模式 chat + Responses 回退最多两次。换 Key 重试共用同一上限
+    budget = timeout * (1 if native_image else 2) if timeout else None
+    started = loop.time()
+    tried: set = set()
+    transient = 0
     try:
-        base_dir = Path(__file__).parent if Path(__file__).exists() else Path(os.getcwd())
-        dbg_path = base_dir / "logs" / "last_openrouter_response.json"
-        dbg_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(dbg_path, "w", encoding="utf-8") as f:
+        while True:
             try:
-                json.dump(_to_plain(completion), f, ensure_ascii=False)
-            except Exception:
-                f.write(str(completion))
-        log.info("Saved debug response to %s", dbg_path)
-    except Exception:
-        pass
-    raise RuntimeError(f"模型未返回图片，返回内容: {debug_txt}...")
+                async with pool.lease(exclude=tried) as state:
+                    tried.add(state)
+                    log.debug("Using OpenRouter key %s (pool size=%d)", mask_key(state.key), len(pool))
+                    if budget:
+                        remaining = budget - (loop.time() - started)
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError(f"deadline of {budget:.0f}s exhausted")
+                        path = await asyncio.wait_for(_attempt(state), remaining)
+                    else:
+                        path = await _attempt(state)
+                break
+            except Exception as e:
+                # 401/429 只说明这个 Key 不可用：冷却后换下一个可用 Key 重试
+                if status_of(e) in (401, 429) and pool.has_available(exclude=tried):
+                    log.warning("Key %s failed with %s, retrying on another key", mask_key(state.key), status_of(e))
+                    continue
+                # 5xx/连接错误：短暂退避后重试（优先换一个没试过的 Key），不超过整体上限
+                if is_transient(e) and transient < TRANSIENT_RETRIES:
+                    transient += 1
+                    delay = min(4.0, 0.5 * 2 ** (transient - 1)) * random.uniform(0.8, 1.2)
+                    if not budget or budget - (loop.time() - started) > delay:
+                        log.warning("Key %s failed transiently (%s), retry %d/%d in %.1fs",
+                                    mask_key(state.key), status_of(e) or type(e).__name__, transient,
+                                    TRANSIENT_RETRIES, delay)
+                        await asyncio.sleep(delay)
+                        continue
+                raise
+    finally:
+        if owns_pool:
+            await pool.aclose()
+    data = written.get("data")
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    return ImageResult(path=path, data=data, mime=sniff_mime(data))
+
+
+async def generate_image_with_openrouter(prompt: str, **kwargs) -> str:
+    """
+    Generate an image using OpenRouter (see ``generate_image_result`` for the options).
+
+    Returns absolute path to the saved image file.
+    """
+    return (await generate_image_result(prompt, **kwargs)).path
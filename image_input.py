@@ -0,0 +1,197 @@
+import io
+import os
+import base64
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+_log = logging.getLogger("AIDrawing")
+
+_MAGIC = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+
+
+def sniff_mime(data: bytes) -> str:
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    return "image/png"
+
+
+def extract_images(chain, *, limit: int = 3) -> list:
+    """
+    Collect Image components from a MessageChain, including images inside a quoted
+    (replied-to) message, in order of appearance.
+    """
+    found = []
+    stack = [iter(chain or [])]
+    while stack and len(found) < limit:
+        try:
+            comp = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            continue
+        name = type(comp).__name__
+        if name == "Image":
+            if getattr(comp, "base64", None) or getattr(comp, "url", None) or getattr(comp, "path", None):
+                found.append(comp)
+        elif getattr(comp, "origin", None):
+            # 回复消息：被引用的原消息位于 Quote.origin
+            stack.append(iter(comp.origin))
+    return found
+
+
+def _fit_to_budget(data: bytes, max_side: int, max_bytes: int) -> tuple[bytes, str]:
+    """Downscale/re-encode ``data`` until it fits ``max_side`` and ``max_bytes`` (runs in a worker)."""
+    mime = sniff_mime(data)
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        if len(data) <= max_bytes:
+            return data, mime
+        raise ValueError(f"参考图过大（{len(data)} 字节），且未安装 Pillow 无法压缩")
+
+    with PILImage.open(io.BytesIO(data)) as im:
+        if len(data) <= max_bytes and max(im.size) <= max_side:
+            return data, mime
+        im = im.convert("RGB")
+        if max(im.size) > max_side:
+            im.thumbnail((max_side, max_side), PILImage.LANCZOS)
+        quality = 90
+        while True:
+            buf = io.BytesIO()
+            im.save(buf, format="JPEG", quality=quality, optimize=True)
+            out = buf.getvalue()
+            if len(out) <= max_bytes or quality <= 40:
+                break
+            quality -= 10
+            if quality <= 60:
+                # 质量降到一定程度后改为缩小尺寸
+                im.thumbnail((int(im.width * 0.8), int(im.height * 0.8)), PILImage.LANCZOS)
+        if len(out) > max_bytes:
+            raise ValueError(f"参考图压缩后仍超过 {max_bytes} 字节")
+        return out, "image/jpeg"
+
+
+class ReferenceImageCache:
+    """
+    Turns incoming Image components into ``data:`` URIs for multimodal ``image_url`` parts.
+
+    Raw bytes are hashed (sha256) and the encoded result is cached per hash, so editing
+    the same picture again skips both the download and the re-encode. Resizing runs in
+    a small worker pool to keep the event loop free.
+
+    The encoded cache is bounded by ``cache_bytes`` (total size of the cached data URIs) as
+    well as by ``cache_size`` entries. ``http_client`` is a callable returning a shared
+    keep-alive httpx client for URL downloads; without it each download opens its own client.
+    """
+
+    def __init__(self, *, max_side: int = 1536, max_bytes: int = 3_000_000, cache_size: int = 64,
+                 cache_bytes: int = 32_000_000, workers: int = 2, http_client=None):
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self._http_client = http_client
+        self._cached_bytes = 0
+        self._by_hash: "OrderedDict[str, str]" = OrderedDict()
+        self._by_url: "OrderedDict[str, str]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="aidrawing-img")
+
+    @classmethod
+    def from_config(cls, cfg: dict | None, http_client=None) -> "ReferenceImageCache":
+        cfg = cfg if isinstance(cfg, dict) else {}
+        return cls(
+            max_side=int(cfg.get("max_side") or 1536),
+            max_bytes=int(cfg.get("max_bytes") or 3_000_000),
+            cache_size=int(cfg.get("cache_size") or 64),
+            cache_bytes=int(cfg.get("cache_bytes") or 32_000_000),
+            workers=int(cfg.get("workers") or 2),
+            http_client=http_client,
+        )
+
+    def _remember(self, table: OrderedDict, key: str, value: str) -> None:
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.cache_size:
+            table.popitem(last=False)
+
+    def _remember_uri(self, digest: str, uri: str) -> None:
+        """按条数与总字节数淘汰最久未用的编码结果"""
+        if len(uri) > self.cache_bytes:
+            return
+        old = self._by_hash.pop(digest, None)
+        if old is not None:
+            self._cached_bytes -= len(old)
+        self._by_hash[digest] = uri
+        self._cached_bytes += len(uri)
+        while self._by_hash and (len(self._by_hash) > self.cache_size or self._cached_bytes > self.cache_bytes):
+            _, evicted = self._by_hash.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    async def _read(self, comp) -> bytes:
+        b64v = getattr(comp, "base64", None)
+        if isinstance(b64v, str) and b64v:
+            if b64v.startswith("data:"):
+                b64v = b64v[b64v.find(",") + 1:]
+            elif b64v.startswith("base64://"):
+                b64v = b64v[len("base64://"):]
+            return base64.b64decode(b64v)
+        url = getattr(comp, "url", None)
+        if isinstance(url, str) and url.startswith("http"):
+            if self._http_client is not None:
+                resp = await self._http_client().get(url, timeout=30)
+                resp.raise_for_status()
+                return resp.content
+            import httpx
+
+            async with httpx.AsyncClient(timeout=30) as client:
+                resp = await client.get(url)
+                resp.raise_for_status()
+                return resp.content
+        path = getattr(comp, "path", None)
+        if path and os.path.exists(str(path)):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, _read_file, str(path))
+        raise ValueError("无法读取参考图")
+
+    async def to_data_uri(self, comp) -> str:
+        url = getattr(comp, "url", None)
+        if isinstance(url, str) and url in self._by_url:
+            digest = self._by_url[url]
+            if digest in self._by_hash:
+                self._by_hash.move_to_end(digest)
+                return self._by_hash[digest]
+
+        data = await self._read(comp)
+        digest = hashlib.sha256(data).hexdigest()
+        if isinstance(url, str) and url:
+            self._remember(self._by_url, url, digest)
+        cached = self._by_hash.get(digest)
+        if cached is not None:
+            self._by_hash.move_to_end(digest)
+            return cached
+
+        loop = asyncio.get_running_loop()
+        out, mime = await loop.run_in_executor(self._executor, _fit_to_budget, data, self.max_side, self.max_bytes)
+        uri = f"data:{mime};base64,{base64.b64encode(out).decode('ascii')}"
+        self._remember_uri(digest, uri)
+        _log.debug("Prepared reference image sha256=%s %d -> %d bytes (%s)", digest[:12], len(data), len(out), mime)
+        return uri
+
+    async def prepare(self, comps: list) -> list[str]:
+        return list(await asyncio.gather(*(self.to_data_uri(c) for c in comps)))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
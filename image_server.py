@@ -0,0 +1,210 @@
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import logging
+import secrets
+import mimetypes
+from email.utils import formatdate
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+
+
+_log = logging.getLogger("AIDrawing")
+
+_REASONS = {
+    200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request", 403: "Forbidden",
+    404: "Not Found", 405: "Method Not Allowed", 416: "Range Not Satisfiable",
+}
+
+
+def adapter_name(adapter) -> str:
+    """适配器名（小写，去掉 Adapter 后缀），例如 aiocqhttp / telegram；取不到时返回空串"""
+    if adapter is None:
+        return ""
+    name = type(adapter).__name__.lower()
+    return name[: -len("adapter")] if name.endswith("adapter") else name
+
+
+def platform_of(event) -> str:
+    return adapter_name(getattr(getattr(event, "query", None), "adapter", None))
+
+
+def platform_enabled(platforms, platform: str) -> bool:
+    if not platforms:
+        return False
+    if isinstance(platforms, str):
+        platforms = [platforms]
+    return "*" in platforms or platform in platforms
+
+
+class ImageServer:
+    """
+    Tiny asyncio HTTP/1.1 server for ``storage.output_dir``.
+
+    Only top-level files are served, and only through signed, expiring URLs
+    (``/img/<name>?exp=<unix>&sig=<hmac>``). Supports GET/HEAD, single byte ranges,
+    ETag/If-None-Match and cache headers; bodies go out via ``loop.sendfile``.
+    """
+
+    def __init__(self, root: str, *, host: str = "127.0.0.1", port: int = 8765, secret: str | None = None,
+                 public_base_url: str | None = None, url_ttl: int = 3600, platforms=None):
+        self.root = os.path.abspath(root)
+        self.host = host
+        self.port = port
+        # 未配置时每次启动随机生成：重启后旧链接失效，符合“带过期时间”的语义
+        self.secret = (secret or secrets.token_hex(16)).encode("utf-8")
+        self.public_base_url = (public_base_url or f"http://{host}:{port}").rstrip("/")
+        self.url_ttl = int(url_ttl)
+        self.platforms = platforms or []
+        self._server: asyncio.AbstractServer | None = None
+
+    @classmethod
+    def from_config(cls, cfg: dict | None, root: str) -> "ImageServer":
+        cfg = cfg if isinstance(cfg, dict) else {}
+        return cls(
+            root,
+            host=cfg.get("host") or "127.0.0.1",
+            port=int(cfg.get("port") or 8765),
+            secret=cfg.get("secret") or None,
+            public_base_url=cfg.get("public_base_url") or None,
+            url_ttl=int(cfg.get("url_ttl") or 3600),
+            platforms=cfg.get("platforms") or [],
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    async def start(self) -> None:
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            _log.info("Image server listening on %s:%s (root=%s, public=%s)",
+                      self.host, self.port, self.root, self.public_base_url)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def serves(self, platform: str) -> bool:
+        return self.running and platform_enabled(self.platforms, platform)
+
+    def _sign(self, name: str, exp: int) -> str:
+        return hmac.new(self.secret, f"{name}:{exp}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+    def url_for(self, path: str) -> str | None:
+        """
+        Signed URL for a file directly under root, or None if the file is outside it.
+
+        The expiry is rounded up to the next ``url_ttl / 2`` boundary, so the same file keeps
+        the same URL (and HTTP cache entry) for that long; every URL stays valid at least
+        ``url_ttl`` seconds.
+        """
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.root:
+            return None
+        name = os.path.basename(path)
+        step = max(1, self.url_ttl // 2)
+        exp = -(-(int(time.time()) + self.url_ttl) // step) * step
+        return f"{self.public_base_url}/img/{quote(name)}?exp={exp}&sig={self._sign(name, exp)}"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            await self._respond(head.decode("latin-1"), writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            _log.debug("Image server request failed: %s", e)
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _respond(self, head: str, writer: asyncio.StreamWriter) -> None:
+        lines = head.split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return await self._send_status(writer, 400)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        if method not in ("GET", "HEAD"):
+            return await self._send_status(writer, 405, {"Allow": "GET, HEAD"})
+
+        parts = urlsplit(target)
+        if not parts.path.startswith("/img/"):
+            return await self._send_status(writer, 404)
+        name = unquote(parts.path[len("/img/"):])
+        if not name or "/" in name or "\\" in name or name.startswith("."):
+            return await self._send_status(writer, 404)
+        query = parse_qs(parts.query)
+        try:
+            exp = int((query.get("exp") or ["0"])[0])
+        except ValueError:
+            exp = 0
+        sig = (query.get("sig") or [""])[0]
+        if exp < time.time() or not hmac.compare_digest(sig, self._sign(name, exp)):
+            return await self._send_status(writer, 403)
+
+        path = os.path.join(self.root, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return await self._send_status(writer, 404)
+        size = st.st_size
+        etag = f'"{size:x}-{st.st_mtime_ns:x}"'
+        base_headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+            # 文件名唯一且内容不变，可在链接有效期内放心缓存
+            "Cache-Control": f"private, max-age={max(0, int(exp - time.time()))}, immutable",
+        }
+        if headers.get("if-none-match") in (etag, "*"):
+            return await self._send_status(writer, 304, base_headers)
+
+        start, end, status = 0, size - 1, 200
+        rng = headers.get("range")
+        if rng and rng.startswith("bytes=") and "," not in rng:
+            first, _, last = rng[len("bytes="):].partition("-")
+            try:
+                if first:
+                    start = int(first)
+                    end = min(int(last), size - 1) if last else size - 1
+                else:
+                    start = max(0, size - int(last))
+                valid = start <= end and start < size
+            except ValueError:
+                valid = False
+            if not valid:
+                return await self._send_status(writer, 416, {"Content-Range": f"bytes */{size}"})
+            status = 206
+            base_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        length = max(0, end - start + 1)
+        base_headers["Content-Type"] = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        base_headers["Content-Length"] = str(length)
+        self._write_head(writer, status, base_headers)
+        await writer.drain()
+        if method == "HEAD" or length == 0:
+            return
+        with open(path, "rb") as f:
+            await asyncio.get_running_loop().sendfile(writer.transport, f, start, length)
+
+    @staticmethod
+    def _write_head(writer: asyncio.StreamWriter, status: int, headers: dict) -> None:
+        out = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        out += [f"{k}: {v}" for k, v in headers.items()]
+        out += ["Connection: close", "", ""]
+        writer.write("\r\n".join(out).encode("latin-1"))
+
+    async def _send_status(self, writer: asyncio.StreamWriter, status: int, headers: dict | None = None) -> None:
+        self._write_head(writer, status, {**(headers or {}), "Content-Length": "0"})
+        await writer.drain()
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import uuid
+import logging
+
+
+_log = logging.getLogger("AIDrawing")
+
+# 任务状态：accepted -> done -> delivered，或 failed
+ACCEPTED, DONE, DELIVERED, FAILED = "accepted", "done", "delivered", "failed"
+
+
+class JobJournal:
+    """
+    Append-only JSONL journal of /p jobs (one record per state change, flushed and fsync'd).
+
+    After a restart ``pending()`` folds the records per job and returns the jobs that were
+    accepted but never finished, or finished but never delivered. ``compact()`` rewrites the
+    file keeping only those; it also runs automatically every ``compact_after`` finished jobs,
+    so the journal stays small on a long-running bot.
+    """
+
+    def __init__(self, path: str, *, compact_after: int = 100):
+        self.path = path
+        self.compact_after = max(1, int(compact_after))
+        self._finished = 0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._f = None
+
+    def _write(self, record: dict) -> None:
+        try:
+            if self._f is None:
+                self._f = open(self.path, "a", encoding="utf-8")
+                if self._f.tell() > 0 and not self._ends_with_newline():
+                    self._f.write("\n")  # 上次崩溃留下的半行单独成行，解析时跳过
+            self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        except Exception as e:
+            _log.warning("Failed to write job journal %s: %s", self.path, e)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def accepted(self, **fields) -> str:
+        job_id = uuid.uuid4().hex[:16]
+        self._write({"job": job_id, "state": ACCEPTED, "ts": time.time(), **fields})
+        return job_id
+
+    def done(self, job_id: str, path: str, **fields) -> None:
+        self._write({"job": job_id, "state": DONE, "ts": time.time(), "path": path, **fields})
+
+    def delivered(self, job_id: str, **fields) -> None:
+        self._write({"job": job_id, "state": DELIVERED, "ts": time.time(), **fields})
+        self._maybe_compact()
+
+    def failed(self, job_id: str, error: str = "", **fields) -> None:
+        self._write({"job": job_id, "state": FAILED, "ts": time.time(), "error": error[:300], **fields})
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        self._finished += 1
+        if self._finished >= self.compact_after:
+            self.compact()
+
+    def _fold(self) -> dict[str, dict]:
+        jobs: dict[str, dict] = {}
+        if not os.path.exists(self.path):
+            return jobs
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 崩溃时可能留下半行
+                job_id = rec.get("job")
+                if not job_id:
+                    continue
+                job = jobs.setdefault(job_id, {"accepted_ts": rec.get("ts")})
+                job.update(rec)
+        return jobs
+
+    def pending(self) -> list[dict]:
+        """未完成（accepted）或已完成未送达（done）的任务，按受理时间排序"""
+        jobs = [j for j in self._fold().values() if j.get("state") in (ACCEPTED, DONE) and j.get("prompt")]
+        jobs.sort(key=lambda j: j.get("accepted_ts") or 0)
+        return jobs
+
+    def compact(self) -> None:
+        """只保留待处理任务的最新状态（原子替换）"""
+        self._finished = 0
+        try:
+            keep = self.pending()
+            self.close()
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for job in keep:
+                    f.write(json.dumps(job, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except Exception as e:
+            _log.warning("Failed to compact job journal %s: %s", self.path, e)
+
+    def close(self) -> None:
+        if self._f is not None:
+            try:
+                self._f.close()
+            except Exception:
+                pass
+            self._f = None
@@ -0,0 +1,277 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+
+_log = logging.getLogger("AIDrawing")
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+_SINGLE_KEY_FIELDS = ("api_key", "apikey", "apiKey", "key", "token", "OPENROUTER_API_KEY")
+_ROOT_KEY_FIELDS = ("openrouter_api_key", "OPENROUTER_API_KEY", "api_key", "apiKey", "apikey", "key", "token")
+
+
+def mask_key(k: str | None) -> str:
+    if not k:
+        return "<empty>"
+    if len(k) <= 8:
+        return f"{k[0]}***{k[-1]}"
+    return f"{k[:4]}***{k[-4:]} (len={len(k)})"
+
+
+def resolve_keys(cfg: dict | None) -> list[str]:
+    """
+    Collect every OpenRouter key from a config dict (root or ``openrouter`` section).
+
+    ``openrouter.api_keys`` may be a list or a comma separated string; the single-key
+    variants (``api_key``/``apikey``/...) are still honoured. ``$OPENROUTER_API_KEY`` is
+    only used when the config has no key at all. Order is preserved and duplicates are dropped.
+    """
+    keys: list[str] = []
+
+    def _add(v) -> None:
+        if isinstance(v, str):
+            for part in v.split(","):
+                part = part.strip()
+                if part and part not in keys:
+                    keys.append(part)
+        elif isinstance(v, (list, tuple)):
+            for item in v:
+                _add(item)
+
+    cfg = cfg if isinstance(cfg, dict) else {}
+    section = cfg.get("openrouter") if isinstance(cfg.get("openrouter"), dict) else {}
+    _add(section.get("api_keys"))
+    for k in _SINGLE_KEY_FIELDS:
+        _add(section.get(k))
+    _add(cfg.get("api_keys"))
+    for k in _ROOT_KEY_FIELDS:
+        _add(cfg.get(k))
+    if not keys:
+        # 环境变量只作兜底，避免配置了 Key 时悄悄把请求分到另一个账号
+        _add(os.getenv("OPENROUTER_API_KEY"))
+    return keys
+
+
+def status_of(exc: BaseException) -> int | None:
+    """Best-effort HTTP status code from an openai/httpx exception."""
+    code = getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code
+    resp = getattr(exc, "response", None)
+    code = getattr(resp, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """5xx/408 or a connection-level failure (no response): worth retrying, the key is fine."""
+    code = status_of(exc)
+    if code is not None:
+        return code >= 500 or code == 408
+    # openai.APIConnectionError（含 APITimeoutError）与 httpx.TransportError；按类名判断以免导入 SDK
+    return any(c.__name__ in ("APIConnectionError", "TransportError") for c in type(exc).__mro__)
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    resp = getattr(exc, "response", None)
+    headers = getattr(resp, "headers", None)
+    if not headers:
+        return None
+    try:
+        v = headers.get("retry-after")
+        return float(v) if v is not None else None
+    except Exception:
+        return None
+
+
+class KeyState:
+    """One API key with its own pooled client, in-flight counter and metrics."""
+
+    def __init__(self, key: str, *, base_url: str, max_connections: int):
+        self.key = key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.remaining: float | None = None  # from x-ratelimit-remaining when the provider sends it
+        self.calls = 0
+        self.errors = 0
+        self.unauthorized = 0
+        self.rate_limited = 0
+        self.latency_total = 0.0
+        self._client = None
+        self._http = None
+
+    @property
+    def client(self):
+        """Lazily built AsyncOpenAI client backed by a dedicated httpx connection pool."""
+        if self._client is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=httpx.Timeout(600.0, connect=10.0),
+            )
+            # 不让 SDK 在同一个 Key 上重试：429/401 由 KeyPool 冷却后换 Key，5xx/连接错误由调用方退避后换 Key 重试
+            self._client = AsyncOpenAI(
+                base_url=self.base_url, api_key=self.key, http_client=self._http, max_retries=0
+            )
+        return self._client
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "key": mask_key(self.key),
+            "in_flight": self.in_flight,
+            "cooling_down_s": round(max(0.0, self.cooldown_until - now), 1),
+            "remaining": self.remaining,
+            "calls": self.calls,
+            "errors": self.errors,
+            "unauthorized": self.unauthorized,
+            "rate_limited": self.rate_limited,
+            "avg_latency_s": round(self.latency_total / self.calls, 3) if self.calls else None,
+        }
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            try:
+                await self._http.aclose()
+            except Exception:
+                pass
+        self._client = None
+        self._http = None
+
+
+class KeyPool:
+    """
+    Spreads OpenRouter calls over several keys.
+
+    ``acquire`` picks the available key with the fewest in-flight requests (ties broken by
+    the larger remaining quota, then fewer total calls). A key that answers 401 or 429 is
+    taken out of rotation for a cooldown period.
+    """
+
+    def __init__(
+        self,
+        keys: list[str],
+        *,
+        base_url: str = OPENROUTER_BASE_URL,
+        max_connections: int = 10,
+        unauthorized_cooldown: float = 600.0,
+        rate_limited_cooldown: float = 60.0,
+    ):
+        self.keys = [KeyState(k, base_url=base_url, max_connections=max_connections) for k in keys]
+        self.unauthorized_cooldown = unauthorized_cooldown
+        self.rate_limited_cooldown = rate_limited_cooldown
+
+    @classmethod
+    def from_config(cls, cfg: dict | None) -> "KeyPool":
+        cfg = cfg if isinstance(cfg, dict) else {}
+        section = cfg.get("openrouter") if isinstance(cfg.get("openrouter"), dict) else {}
+        cooldown = section.get("key_cooldown") if isinstance(section.get("key_cooldown"), dict) else {}
+        return cls(
+            resolve_keys(cfg),
+            base_url=section.get("base_url") or OPENROUTER_BASE_URL,
+            max_connections=int(section.get("max_connections_per_key") or 10),
+            unauthorized_cooldown=float(cooldown.get("unauthorized", 600)),
+            rate_limited_cooldown=float(cooldown.get("rate_limited", 60)),
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def has_available(self, exclude=()) -> bool:
+        """是否还有未在 ``exclude`` 中、且不在冷却期的 Key"""
+        now = time.monotonic()
+        return any(k.available(now) and k not in exclude for k in self.keys)
+
+    def acquire(self, exclude=()) -> KeyState:
+        """Pick a key, skipping ``exclude`` (keys already tried for this request) when possible."""
+        if not self.keys:
+            raise RuntimeError("OPENROUTER_API_KEY is not set in environment")
+        now = time.monotonic()
+        pool = [k for k in self.keys if k not in exclude] or self.keys
+        candidates = [k for k in pool if k.available(now)]
+        if not candidates:
+            # 全部冷却中：选最早恢复的那个，而不是直接失败
+            candidates = [min(pool, key=lambda k: k.cooldown_until)]
+        state = min(
+            candidates,
+            key=lambda k: (k.in_flight, -(k.remaining if k.remaining is not None else float("inf")), k.calls),
+        )
+        state.in_flight += 1
+        return state
+
+    def release(self, state: KeyState, *, latency: float | None = None, error: BaseException | None = None) -> None:
+        state.in_flight = max(0, state.in_flight - 1)
+        state.calls += 1
+        if latency is not None:
+            state.latency_total += latency
+        if error is None:
+            return
+        state.errors += 1
+        code = status_of(error)
+        now = time.monotonic()
+        if code == 401:
+            state.unauthorized += 1
+            state.cooldown_until = now + self.unauthorized_cooldown
+            _log.warning("Key %s got 401, out of rotation for %.0fs", mask_key(state.key), self.unauthorized_cooldown)
+        elif code == 429:
+            state.rate_limited += 1
+            wait = _retry_after(error) or self.rate_limited_cooldown
+            state.cooldown_until = now + wait
+            _log.warning("Key %s got 429, out of rotation for %.0fs", mask_key(state.key), wait)
+
+    @asynccontextmanager
+    async def lease(self, exclude=()):
+        """``async with pool.lease() as state:`` — acquire a key and release it with the outcome."""
+        state = self.acquire(exclude)
+        started = time.monotonic()
+        try:
+            yield state
+        except BaseException as e:
+            self.release(state, latency=time.monotonic() - started, error=e)
+            raise
+        else:
+            self.release(state, latency=time.monotonic() - started)
+
+    async def warm_up(self, *, preconnect: bool = True) -> None:
+        """Build every key's client and, if ``preconnect``, open its pooled TLS connection."""
+        await asyncio.gather(*(self._warm_key(k, preconnect) for k in self.keys))
+
+    async def _warm_key(self, state: KeyState, preconnect: bool) -> None:
+        state.client  # noqa: B018 - builds the AsyncOpenAI/httpx pair
+        if not preconnect or state._http is None:
+            return
+        # GET /key is tiny, opens the keep-alive connection and reports the remaining credit
+        try:
+            resp = await state._http.get(
+                f"{state.base_url}/key", headers={"Authorization": f"Bearer {state.key}"}, timeout=10.0
+            )
+            if resp.status_code == 401:
+                state.unauthorized += 1
+                state.cooldown_until = time.monotonic() + self.unauthorized_cooldown
+                _log.warning("Key %s rejected during warm-up (401)", mask_key(state.key))
+                return
+            data = (resp.json() or {}).get("data") or {}
+            remaining = data.get("limit_remaining")
+            if isinstance(remaining, (int, float)):
+                state.remaining = float(remaining)
+        except Exception as e:
+            _log.debug("Pre-connect for key %s failed: %s", mask_key(state.key), e)
+
+    def snapshot(self) -> list[dict]:
+        now = time.monotonic()
+        return [k.snapshot(now) for k in self.keys]
+
+    async def aclose(self) -> None:
+        for k in self.keys:
+            await k.aclose()
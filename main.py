@@ -9,31 +9,51 @@ except Exception:
 import re
 import os
 import json
+import time
 import uuid
 import logging
 from pathlib import Path
 import base64
 
-# Prefer local get_image within this plugin; fall back gracefully
+import sys
+import asyncio
+
+# 均为轻量模块：openai/httpx 等重依赖延迟到 warm_up 或首次调用时才导入
 try:
-    # Relative import when package context is available
-    from .get_image import generate_image_with_openrouter  # type: ignore
-except Exception:
-    try:
-        # Direct import if executed as a flat module
-        from get_image import generate_image_with_openrouter  # type: ignore
-    except Exception:
-        # Last resort: load by path to handle non-standard plugin loaders
-        import importlib.util
-        import pathlib
-        _base_dir = pathlib.Path(__file__).parent
-        _spec = importlib.util.spec_from_file_location("get_image", _base_dir / "get_image.py")
-        if _spec and _spec.loader:
-            _mod = importlib.util.module_from_spec(_spec)
-            _spec.loader.exec_module(_mod)  # type: ignore
-            generate_image_with_openrouter = _mod.generate_image_with_openrouter  # type: ignore
-        else:
-            raise ImportError("Cannot load local get_image.py")
+    # Relative import when loaded as a package
+    from .settings import default_config, load_config, resolve_output_dir  # type: ignore
+    from .key_pool import KeyPool, mask_key  # type: ignore
+    from .image_input import ReferenceImageCache, extract_images  # type: ignore
+    from .get_image import generate_image_result, warm_up, get_http_client, close_http_client  # type: ignore
+    from .ratelimit import RateLimiter, session_key  # type: ignore
+    from .results import ResultRegistry  # type: ignore
+    from .image_server import ImageServer, platform_of, adapter_name, platform_enabled  # type: ignore
+    from .preview import ThumbnailWorker  # type: ignore
+    from .metrics import Metrics  # type: ignore
+    from .adaptive import AdaptiveRegistry  # type: ignore
+    from .shared import create_backend  # type: ignore
+    from .cache import GenerationCache  # type: ignore
+    from .prefetch import Prefetcher, PromptStats  # type: ignore
+    from .journal import JobJournal  # type: ignore
+except ImportError:
+    # Flat modules; main.py may have been loaded by path, so make its siblings importable
+    _plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    if _plugin_dir not in sys.path:
+        sys.path.insert(0, _plugin_dir)
+    from settings import default_config, load_config, resolve_output_dir  # type: ignore
+    from key_pool import KeyPool, mask_key  # type: ignore
+    from image_input import ReferenceImageCache, extract_images  # type: ignore
+    from get_image import generate_image_result, warm_up, get_http_client, close_http_client  # type: ignore
+    from ratelimit import RateLimiter, session_key  # type: ignore
+    from results import ResultRegistry  # type: ignore
+    from image_server import ImageServer, platform_of, adapter_name, platform_enabled  # type: ignore
+    from preview import ThumbnailWorker  # type: ignore
+    from metrics import Metrics  # type: ignore
+    from adaptive import AdaptiveRegistry  # type: ignore
+    from shared import create_backend  # type: ignore
+    from cache import GenerationCache  # type: ignore
+    from prefetch import Prefetcher, PromptStats  # type: ignore
+    from journal import JobJournal  # type: ignore
 
 # 兼容不同宿主中事件类名差异：将 Normal* 名称映射到 Person*
 try:
@@ -62,6 +82,8 @@ except NameError:
 )
 class Fct(BasePlugin):
     def __init__(self, host: APIHost):
+        # 未调用 BasePlugin.__init__，手动保存 host（重启后补发消息时使用）
+        self.host = host
         # setup file logger once
         try:
             base_dir_for_log = Path(__file__).parent
@@ -88,50 +110,24 @@ class Fct(BasePlugin):
         except Exception:
             base_dir = os.getcwd()
         cfg_path = os.path.join(base_dir, 'config.json')
-        self.config = {
-            "command_prefix": "/p",
-            "openrouter": {
-                "enabled": True,
-                "model": "google/gemini-2.5-flash-image-preview:free",
-                "api_key": "",
-                "site_url": "",
-                "site_title": "",
-            },
-            "storage": {"output_dir": "generated"},
-            "fallback": {"enabled": True, "provider": "pollinations"},
-        }
+        self.config = default_config()
+        self._key_pool = KeyPool([])
         try:
-            if os.path.exists(cfg_path):
-                with open(cfg_path, 'r', encoding='utf-8') as f:
-                    # 浅合并配置
-                    user_cfg = json.load(f)
-                    def merge(dst, src):
-                        for k, v in src.items():
-                            if isinstance(v, dict) and isinstance(dst.get(k), dict):
-                                merge(dst[k], v)
-                            else:
-                                dst[k] = v
-                    merge(self.config, user_cfg)
-            # Normalize API key after merge: support variants and env
+            # 默认配置与 config.json 递归合并（与批量生成 CLI 共用）
+            self.config = load_config(cfg_path)
+            # Normalize API keys after merge: api_keys list, single-key variants and env
+            self._key_pool = KeyPool.from_config(self.config)
             _open = self.config.get('openrouter', {}) or {}
-            def _pick_key(d: dict):
-                if not isinstance(d, dict):
-                    return None
-                for _k in ("api_key", "apikey", "apiKey", "key", "token", "OPENROUTER_API_KEY"):
-                    _v = d.get(_k)
-                    if isinstance(_v, str) and _v.strip():
-                        return _v.strip()
-                return None
-            _resolved_key = _pick_key(_open) or _pick_key(self.config) or os.getenv('OPENROUTER_API_KEY')
-            if _resolved_key:
+            if len(self._key_pool):
                 # Persist normalized location for downstream usage
-                _open['api_key'] = _resolved_key
+                _open['api_keys'] = [k.key for k in self._key_pool.keys]
+                _open['api_key'] = _open['api_keys'][0]
                 self.config['openrouter'] = _open
                 if hasattr(self, 'ap') and getattr(self, 'ap', None):
-                    self.ap.logger.info(f"OpenRouter API Key 已配置 (len={len(_resolved_key)}). 配置文件: {cfg_path}")
+                    self.ap.logger.info(f"OpenRouter API Key 已配置 (count={len(self._key_pool)}). 配置文件: {cfg_path}")
                 # also write to file log
                 try:
-                    self._logger.info(f"API key detected via config/env. len={len(_resolved_key)}; cfg={cfg_path}")
+                    self._logger.info(f"API keys detected via config/env. count={len(self._key_pool)} keys={[mask_key(k.key) for k in self._key_pool.keys]}; cfg={cfg_path}")
                 except Exception:
                     pass
             else:
@@ -156,14 +152,8 @@ class Fct(BasePlugin):
             self._logger.info(f"Config loaded - storage config: {storage_cfg}")
             self._logger.info(f"Raw output dir from config: {raw_out_dir}")
 
-            try:
-                _plugin_dir = os.path.dirname(__file__)
-            except Exception:
-                _plugin_dir = os.getcwd()
-            out_dir = raw_out_dir if os.path.isabs(raw_out_dir) else os.path.join(_plugin_dir, raw_out_dir)
             # 回写标准化后的绝对路径，便于后续调用
-            if isinstance(self.config.get('storage'), dict):
-                self.config['storage']['output_dir'] = out_dir
+            out_dir = resolve_output_dir(self.config)
             os.makedirs(out_dir, exist_ok=True)
             # 记录配置的路径信息
             self._logger.info(f"Output directory configured: {out_dir}")
@@ -177,6 +167,339 @@ class Fct(BasePlugin):
             except Exception:
                 pass
 
+        # 限流器：判定纯内存，每日配额持久化到插件目录 data/ 下，重启后保留
+        try:
+            _state_dir = os.path.join(os.path.dirname(__file__), 'data')
+        except Exception:
+            _state_dir = os.path.join(os.getcwd(), 'data')
+        # 可选的跨进程共享后端（sqlite/redis）：结果缓存、进行中去重与每日配额由同机多个进程共用
+        _shared_cfg = self.config.get('shared', {}) or {}
+        try:
+            self._shared = create_backend(_shared_cfg, os.path.dirname(os.path.abspath(__file__)))
+        except Exception as e:
+            self._shared = create_backend(None, '')
+            try:
+                self._logger.warning("Shared backend unavailable, using process-local state: %s", e)
+            except Exception:
+                pass
+        self._limiter = RateLimiter(
+            self.config.get('rate_limit'), os.path.join(_state_dir, 'ratelimit.json'), backend=self._shared
+        )
+        # 图生图：参考图按内容哈希缓存，压缩/重编码在工作线程池中进行
+        self._ref_images = ReferenceImageCache.from_config(self.config.get('edit'), http_client=get_http_client)
+
+        # 可选的本地图片服务：对能拉取 URL 的平台以签名链接代替内联 base64
+        _server_cfg = self.config.get('server', {}) or {}
+        self._image_server = None
+        if _server_cfg.get('enabled', False):
+            self._image_server = ImageServer.from_config(_server_cfg, self.config.get('storage', {}).get('output_dir') or 'generated')
+
+        # 渐进式发送：按平台开启，缩略图在独立工作进程中生成
+        _preview_cfg = self.config.get('preview', {}) or {}
+        self._previews = None
+        self._preview_platforms = _preview_cfg.get('platforms') or []
+        self._preview_min_bytes = int(_preview_cfg.get('min_bytes') or 0)
+        # 完整图等待预览的上限；默认 0：完整图就绪即发送，不为预览让路
+        self._preview_max_wait = float(_preview_cfg.get('max_wait', 0))
+        if _preview_cfg.get('enabled', False):
+            self._previews = ThumbnailWorker(
+                max_side=int(_preview_cfg.get('max_side') or 320), quality=int(_preview_cfg.get('quality') or 70)
+            )
+
+        # Drawer -> convert_message 的结果交接表（按会话、带 TTL）
+        _results_cfg = self.config.get('results', {}) or {}
+        self._results = ResultRegistry(
+            ttl=float(_results_cfg.get('ttl', 600)), max_entries=int(_results_cfg.get('max_entries', 256))
+        )
+
+        # 按 provider/model 的自适应超时与 AIMD 并发控制，决策写入 metrics
+        self.metrics = Metrics()
+        self._adaptive = AdaptiveRegistry(self.config.get('adaptive'), self.metrics)
+        # 可选：相同 model+prompt 的文生图结果缓存并去重（进程内共享 future，进程间依赖 claim）；
+        # 默认关闭，关闭时每次 /p 都重新生成
+        self._cache = GenerationCache(
+            self._shared, enabled=bool(_shared_cfg.get('cache', False)), ttl=float(_shared_cfg.get('cache_ttl', 86400)),
+            wait_timeout=float(_shared_cfg.get('wait_timeout', 300)), metrics=self.metrics,
+        )
+
+        # 预取：统计 /p 提示词频率（data/prompt_stats.json），提供方空闲时在每小时预算内预渲染热门提示词
+        _prefetch_cfg = self.config.get('prefetch', {}) or {}
+        self._prefetcher = Prefetcher(
+            _prefetch_cfg,
+            stats=PromptStats(
+                os.path.join(_state_dir, 'prompt_stats.json'),
+                half_life_days=float(_prefetch_cfg.get('half_life_days', 7)),
+                max_tracked=int(_prefetch_cfg.get('max_tracked', 500)),
+            ),
+            cache=self._cache,
+            adaptive=self._adaptive,
+            generate=self._generate_background,
+            model_for=lambda _recorded: self._current_model(),
+            native_for=self._supports_image_output,
+            metrics=self.metrics,
+        )
+        if self._prefetcher.enabled and not self._cache.enabled:
+            # 预取结果只能经由结果缓存交付
+            self._prefetcher.enabled = False
+            try:
+                self._logger.warning("prefetch.enabled requires shared.cache=true; prefetch disabled")
+            except Exception:
+                pass
+
+        # 任务日志：/p 任务的受理/完成/送达追加写入 data/jobs.jsonl；退出时排空进行中的任务，启动时补发或重跑
+        _journal_cfg = self.config.get('journal', {}) or {}
+        self._journal = JobJournal(os.path.join(_state_dir, 'jobs.jsonl'))
+        self._journal_max_age = float(_journal_cfg.get('max_age', 1800))
+        self._drain_timeout = float(_journal_cfg.get('drain_timeout', 30))
+        self._accepting = True
+        self._live_tasks: set[asyncio.Task] = set()
+        self._replay_task = None
+
+        # 预热：initialize() 后台导入 SDK、构建连接池并预连接；ready 为 True 表示已完成
+        self.ready = False
+        self._warmup_task = None
+
+    async def initialize(self):
+        if self._image_server is not None:
+            try:
+                await self._image_server.start()
+            except Exception as e:
+                self._image_server = None
+                try:
+                    self._logger.warning("Failed to start image server, falling back to inline images: %s", e)
+                except Exception:
+                    pass
+        self._prefetcher.start()
+        warm_cfg = self.config.get('warmup', {}) or {}
+        if warm_cfg.get('enabled', True):
+            # 不阻塞宿主启动：预热在后台进行，首个请求会等待它完成
+            self._warmup_task = asyncio.ensure_future(self._warm_up(bool(warm_cfg.get('preconnect', True))))
+        else:
+            self.ready = True
+        # 上次退出时未完成/未送达的 /p 任务在后台重放
+        self._replay_task = asyncio.ensure_future(self._replay_jobs())
+
+    async def destroy(self):
+        # 优雅退出：先停止受理新任务，再在 drain_timeout 内等待进行中的 /p 完成；
+        # 超时未完成的任务保留在任务日志中，下次启动时重放
+        self._accepting = False
+        await self._prefetcher.stop()
+        if self._replay_task is not None and not self._replay_task.done():
+            self._replay_task.cancel()
+        if self._live_tasks:
+            _, unfinished = await asyncio.wait(set(self._live_tasks), timeout=self._drain_timeout)
+            if unfinished:
+                try:
+                    self.ap.logger.warning(f"{len(unfinished)} 个绘图任务未在 {self._drain_timeout:g} 秒内完成，将在下次启动时重放")
+                except Exception:
+                    pass
+                # 先取消再关闭连接池：否则这些任务会因连接关闭而失败、走回退并被记为已送达
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.gather(*unfinished, return_exceptions=True)
+        if self._image_server is not None:
+            await self._image_server.stop()
+        if self._previews is not None:
+            self._previews.shutdown()
+        self._ref_images.shutdown()
+        try:
+            self._logger.info("Metrics at shutdown: %s", json.dumps(self.metrics.snapshot(), ensure_ascii=False))
+        except Exception:
+            pass
+        # 关闭各 Key 的连接池与共享下载连接，避免插件重载后泄漏 socket
+        await self._key_pool.aclose()
+        await close_http_client()
+        self._journal.close()
+        self._shared.close()
+
+    async def _replay_jobs(self):
+        """补发已完成但未送达的结果（从磁盘读取，不重新生成），重跑未完成的文生图任务"""
+        try:
+            jobs = self._journal.pending()
+        except Exception as e:
+            self._logger.warning("Failed to read job journal: %s", e)
+            return
+        # 无论是否有待处理任务都压缩一次，清掉已送达/失败的记录
+        self._journal.compact()
+        if not jobs:
+            return
+        self._logger.info(f"Replaying {len(jobs)} unfinished job(s) from journal")
+        await self._ensure_ready()
+        # 发送失败（适配器尚未就绪、连接未建立等）的任务保留在日志中，退避重试直到过期
+        delay = 5.0
+        while jobs and self._accepting:
+            retry = []
+            for job in jobs:
+                if not self._accepting:
+                    return
+                if time.time() - float(job.get('accepted_ts') or 0) > self._journal_max_age:
+                    self._journal.failed(job['job'], 'expired')
+                    continue
+                try:
+                    await self._replay_one(job)
+                except Exception as e:
+                    retry.append(job)
+                    try:
+                        self._logger.warning("Replay of job %s failed, will retry in %.0fs: %s", job['job'], delay, e)
+                    except Exception:
+                        pass
+            jobs = retry
+            if jobs:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 300.0)
+        self._journal.compact()
+
+    async def _replay_one(self, job: dict):
+        job_id = job['job']
+        platform = job.get('platform') or ''
+        path = job.get('path')
+        if job.get('state') == 'done' and path and os.path.exists(path):
+            image = self._image_for(None, path, platform=platform)
+            what = 'journal.redelivered'
+        elif job.get('edit'):
+            # 参考图未保存，图生图任务无法重跑
+            await self._send_to(job, MessageChain([Plain(f"插件重启打断了图生图任务，请重新发送：{job['prompt'][:50]}")]))
+            self._journal.failed(job_id, 'interrupted edit job')
+            return
+        else:
+            model = job.get('model') or self._current_model()
+            result, _ = await self._cache.get_or_generate(
+                self._cache.key(model, job['prompt'], self._supports_image_output(model)),
+                lambda: self._generate_background(job['prompt'], model), model=model, prompt=job['prompt'],
+            )
+            self._journal.done(job_id, path=result.path)
+            # 重试时只需重新发送，不再重新生成
+            job.update(state='done', path=result.path)
+            image = self._image_for(None, result.path, result.data, platform=platform)
+            what = 'journal.regenerated'
+        await self._send_to(job, MessageChain([image]))
+        self._journal.delivered(job_id, replayed=True)
+        self.metrics.incr(what)
+
+    async def _deliver(self, ctx: EventContext, job_id: str, chain, **fields):
+        """主动发送结果，发送成功后才记为 delivered。发送失败时改由宿主回复，
+        任务保持 done，下次启动时补发（至少送达一次）"""
+        try:
+            await ctx.send_message(ctx.event.launcher_type, str(ctx.event.launcher_id), chain)
+        except Exception as e:
+            try:
+                self._logger.warning("Direct send failed for job %s, replying via host: %s", job_id, e)
+            except Exception:
+                pass
+            return ctx.add_return('reply', chain)
+        self._journal.delivered(job_id, **fields)
+        # 已发送：阻止宿主继续把 /p 消息交给 LLM
+        ctx.prevent_default()
+
+    async def _send_to(self, job: dict, chain):
+        """按任务日志中记录的平台与会话主动发送消息"""
+        adapters = list(self.host.get_platform_adapters() or [])
+        platform = job.get('platform') or ''
+        adapter = next((a for a in adapters if adapter_name(a) == platform), None)
+        if adapter is None and len(adapters) == 1:
+            adapter = adapters[0]
+        if adapter is None:
+            raise RuntimeError(f"找不到平台适配器: {platform or '未知'}")
+        await self.host.send_active_message(
+            adapter=adapter,
+            target_type=job.get('launcher_type') or 'group',
+            target_id=str(job.get('launcher_id')),
+            message=chain,
+        )
+
+    async def _send_preview(self, ctx: EventContext, data: bytes, started: float, full_sent: asyncio.Event):
+        try:
+            thumb = await self._previews.thumbnail(data)
+            if not thumb:
+                return
+            if full_sent.is_set():
+                # 完整图已送达：预览晚于完整图到达没有意义
+                self.metrics.incr('delivery.preview_skipped')
+                return
+            await ctx.send_message(
+                ctx.event.launcher_type, str(ctx.event.launcher_id),
+                MessageChain([Image(base64=base64.b64encode(thumb).decode('utf-8'))]),
+            )
+            self._record_timing('first_pixel', started)
+        except Exception as e:
+            try:
+                self._logger.debug("Preview failed: %s", e)
+            except Exception:
+                pass
+
+    def _record_timing(self, what: str, started: float):
+        elapsed = asyncio.get_running_loop().time() - started
+        self.metrics.incr(f"delivery.{what}.count")
+        self.metrics.incr(f"delivery.{what}.total_s", elapsed)
+        self.metrics.gauge(f"delivery.{what}.last_s", round(elapsed, 3))
+
+    def _image_for(self, event, path: str, data: bytes | None = None, platform: str | None = None):
+        """可拉取 URL 的平台发签名链接，其余平台内联 base64（优先使用内存中的图片数据）"""
+        platform = platform_of(event) if platform is None else platform
+        if self._image_server is not None and self._image_server.serves(platform):
+            url = self._image_server.url_for(path)
+            if url:
+                return Image(url=url)
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        return Image(base64=base64.b64encode(data).decode('utf-8'))
+
+    async def _warm_up(self, preconnect: bool = True):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await warm_up(self._key_pool, preconnect=preconnect)
+            if self._previews is not None:
+                await self._previews.warm()
+            self._logger.info(f"Warm-up finished in {loop.time() - started:.2f}s (keys={len(self._key_pool)}, preconnect={preconnect})")
+        except Exception as e:
+            try:
+                self._logger.warning("Warm-up failed, first request will run cold: %s", e)
+            except Exception:
+                pass
+        finally:
+            self.ready = True
+
+    def _current_model(self) -> str:
+        model = (self.config.get('openrouter', {}) or {}).get('model')
+        return model or 'google/gemini-2.5-flash-image-preview:free'
+
+    async def _generate_background(self, prompt: str, model: str):
+        """后台生成（预取、重启后重跑）：与 /p 相同的生成参数，不发预览、不回退"""
+        await self._ensure_ready()
+        openrouter_cfg = self.config.get('openrouter', {}) or {}
+        out_dir = self.config.get('storage', {}).get('output_dir') or 'generated'
+        os.makedirs(out_dir, exist_ok=True)
+        async with self._adaptive.slot('openrouter', model) as deadline:
+            return await generate_image_result(
+                prompt,
+                out_path=os.path.join(out_dir, f"prefetch_{uuid.uuid4().hex}.png"),
+                site_url=(openrouter_cfg.get('site_url') or None),
+                site_title=(openrouter_cfg.get('site_title') or None),
+                model=model,
+                key_pool=self._key_pool,
+                timeout=deadline,
+                native_image=self._supports_image_output(model),
+            )
+
+    def _supports_image_output(self, model: str) -> bool:
+        """按 openrouter.model_capabilities 判断模型是否支持原生图片输出（未配置的模型默认支持）"""
+        caps = (self.config.get('openrouter', {}) or {}).get('model_capabilities') or {}
+        model_caps = caps.get(model) if isinstance(caps, dict) else None
+        if isinstance(model_caps, dict):
+            return bool(model_caps.get('image_output', True))
+        return True
+
+    async def _ensure_ready(self):
+        if self.ready or self._warmup_task is None:
+            return
+        timeout = float((self.config.get('warmup', {}) or {}).get('timeout', 10))
+        try:
+            await asyncio.wait_for(asyncio.shield(self._warmup_task), timeout)
+        except Exception:
+            pass
+
     @llm_func(name="Drawer")
     async def _(self,query, keywords: str)->str:
         """Call this function to draw something before you answer any questions.
@@ -191,7 +514,19 @@ class Fct(BasePlugin):
         Returns:
             img: The generated image.
         """
+        # 先检查是否在受理，排空期间不扣减令牌与配额
+        if not self._accepting:
+            return "插件正在重启，请稍后再试"
+        decision = self._limiter.check(
+            getattr(query, 'launcher_type', None),
+            getattr(query, 'launcher_id', None),
+            getattr(query, 'sender_id', None),
+        )
+        if not decision.allowed:
+            return decision.message
         self.ap.logger.info(f"优化后关键词,{keywords}")
+        self._prefetcher.note_live()
+        await self._ensure_ready()
         cfg = self.config
         openrouter_cfg = cfg.get('openrouter', {})
         fallback_cfg = cfg.get('fallback', {})
@@ -212,27 +547,6 @@ class Fct(BasePlugin):
         except Exception:
             pass
 
-        # Helper to robustly extract API key from config/root/env
-        def _get_api_key(openrouter_dict, root_cfg=self.config):
-            import os as _os
-            # 1) check openrouter section
-            if isinstance(openrouter_dict, dict):
-                for k in ("api_key", "apikey", "apiKey", "key", "token", "OPENROUTER_API_KEY"):
-                    v = openrouter_dict.get(k)
-                    if isinstance(v, str) and v.strip():
-                        return v.strip()
-            # 2) check root-level fallbacks
-            if isinstance(root_cfg, dict):
-                for k in ("openrouter_api_key", "OPENROUTER_API_KEY", "api_key", "apiKey", "apikey", "key", "token"):
-                    v = root_cfg.get(k)
-                    if isinstance(v, str) and v.strip():
-                        return v.strip()
-            # 3) environment
-            v = _os.getenv("OPENROUTER_API_KEY")
-            if isinstance(v, str) and v.strip():
-                return v.strip()
-            return None
-
         if openrouter_cfg.get('enabled', True):
             try:
                 # 确保输出目录存在
@@ -241,21 +555,24 @@ class Fct(BasePlugin):
                 out_path = os.path.join(out_dir, filename)
                 try:
                     # file log what we will call
-                    key_for_call = (_get_api_key(openrouter_cfg) or None)
-                    masked = (key_for_call[:4] + '***' + key_for_call[-4:]) if isinstance(key_for_call, str) and len(key_for_call) >= 8 else str(bool(key_for_call))
-                    self._logger.info(f"Call generate_image_with_openrouter keywords_len={len(keywords)} model={openrouter_cfg.get('model')} out_path={out_path} api_key={masked}")
+                    self._logger.info(f"Call generate_image_result keywords_len={len(keywords)} model={openrouter_cfg.get('model')} out_path={out_path} keys={len(self._key_pool)}")
                 except Exception:
                     pass
-                img_path = await generate_image_with_openrouter(
-                    keywords,
-                    out_path=out_path,
-                    site_url=(openrouter_cfg.get('site_url') or None),
-                    site_title=(openrouter_cfg.get('site_title') or None),
-                    model=openrouter_cfg.get('model', 'google/gemini-2.5-flash-image-preview:free') or 'google/gemini-2.5-flash-image-preview:free',
-                    api_key=(_get_api_key(openrouter_cfg) or None),
-                )
-                # 直接返回文件路径，由消息处理器处理
-                return f"图片已生成: {img_path}"
+                model = openrouter_cfg.get('model', 'google/gemini-2.5-flash-image-preview:free') or 'google/gemini-2.5-flash-image-preview:free'
+                async with self._adaptive.slot('openrouter', model) as deadline:
+                    result = await generate_image_result(
+                        keywords,
+                        out_path=out_path,
+                        site_url=(openrouter_cfg.get('site_url') or None),
+                        site_title=(openrouter_cfg.get('site_title') or None),
+                        model=model,
+                        key_pool=self._key_pool,
+                        timeout=deadline,
+                        native_image=self._supports_image_output(model),
+                    )
+                # 结果按会话+发送者登记，只把短令牌交给 LLM；convert_message 凭令牌直接取回图片数据
+                token = self._results.put(self._results_key(query), result)
+                return f"图片已生成 {self._results.marker(token)}"
             except Exception as e:
                 self.ap.logger.warning(f"OpenRouter 生成失败，准备回退: {e}")
                 try:
@@ -269,16 +586,31 @@ class Fct(BasePlugin):
         # 若禁用回退，直接返回错误信息
         return f"生成失败，且已禁用回退"
 
+    @staticmethod
+    def _results_key(obj) -> str:
+        """Drawer 结果的登记键：会话 + 发送者，群聊中别人的回复不会取走这张图"""
+        conv = session_key(getattr(obj, 'launcher_type', None), getattr(obj, 'launcher_id', None))
+        return f"{conv}:{getattr(obj, 'sender_id', '')}"
+
     # 发送图片
     @handler(NormalMessageResponded)
     async def convert_message(self, ctx: EventContext):
         message = getattr(ctx.event, 'response_text', '') or ''
 
+        # 0) Drawer 生成的图片：按会话令牌直接取回内存中的图片数据，无需解析路径或读文件
+        results = self._results.take_for(self._results_key(ctx.event), message)
+        if results:
+            try:
+                self.ap.logger.info(f"检测到生成的图片，正在发送.. {[r.path for r in results]}")
+                ctx.add_return('reply', MessageChain([self._image_for(ctx.event, r.path, r.data) for r in results]))
+            except Exception as e:
+                await ctx.send_message(ctx.event.launcher_type, str(ctx.event.launcher_id), MessageChain([f"发生了一个错误：{e}"]))
+            return
+
         # 正则
         image_pattern = re.compile(r'(https://image[^\s)]+)')
         file_pattern = re.compile(r'(file://[^\s)]+)')
         markdown_image_pattern = re.compile(r'!\[[^\]]*\]\(([^)]+)\)')
-        generated_image_pattern = re.compile(r'图片已生成:\s*([A-Za-z]:\\[^\n\r]*?\.(?:png|jpg|jpeg|gif|webp)|/[^\n\r]*?\.(?:png|jpg|jpeg|gif|webp))', re.IGNORECASE)
 
         def _sanitize_path(p: str) -> str:
             p = (p or '').strip().strip('"').strip("'")
@@ -300,34 +632,7 @@ class Fct(BasePlugin):
             except Exception:
                 return False
 
-        def _image_to_base64(file_path: str) -> str:
-            """将本地图片转换为 base64 格式"""
-            try:
-                with open(file_path, 'rb') as f:
-                    img_data = f.read()
-                    b64_data = base64.b64encode(img_data).decode('utf-8')
-                    return b64_data
-            except Exception as e:
-                self.ap.logger.error(f"转换图片为 base64 失败: {e}")
-                raise
-
-        # 1) “图片已生成: 本地路径”
-        m = generated_image_pattern.search(message)
-        if m:
-            path = _sanitize_path(m.group(1))
-            try:
-                self.ap.logger.info(f"检测到生成的图片，正在发送.. {path}")
-                if os.path.exists(path):
-                    # 转换为 base64 发送，避免路径识别问题
-                    b64_data = _image_to_base64(path)
-                    ctx.add_return('reply', MessageChain([Image(base64=b64_data)]))
-                else:
-                    ctx.add_return('reply', MessageChain([Plain(f"图片文件不存在: {path}")]))
-            except Exception as e:
-                await ctx.send_message(ctx.event.launcher_type, str(ctx.event.launcher_id), MessageChain([f"发生了一个错误：{e}"]))
-            return
-
-        # 2) Markdown 本地图片
+        # 1) Markdown 本地图片
         m = markdown_image_pattern.search(message)
         if m:
             path = _sanitize_path(m.group(1))
@@ -337,16 +642,14 @@ class Fct(BasePlugin):
                 if _is_http_url(m.group(1)):
                     ctx.add_return('reply', MessageChain([Image(url=m.group(1))]))
                 elif os.path.exists(path):
-                    # 转换为 base64 发送
-                    b64_data = _image_to_base64(path)
-                    ctx.add_return('reply', MessageChain([Image(base64=b64_data)]))
+                    ctx.add_return('reply', MessageChain([self._image_for(ctx.event, path)]))
                 else:
                     ctx.add_return('reply', MessageChain([Plain(f"图片文件不存在: {path}")]))
             except Exception as e:
                 await ctx.send_message(ctx.event.launcher_type, str(ctx.event.launcher_id), MessageChain([f"发生了一个错误：{e}"]))
             return
 
-        # 3) 远程图片 URL
+        # 2) 远程图片 URL
         m = image_pattern.search(message)
         if m:
             url = m.group(1)
@@ -359,7 +662,7 @@ class Fct(BasePlugin):
                 await ctx.send_message(ctx.event.launcher_type, str(ctx.event.launcher_id), MessageChain([f"发生了一个错误：{e}"]))
             return
 
-        # 4) file:// URL -> 转成本地路径
+        # 3) file:// URL -> 转成本地路径
         m = file_pattern.search(message)
         if m:
             file_url = (m.group(1) or '').strip()
@@ -368,16 +671,14 @@ class Fct(BasePlugin):
             try:
                 self.ap.logger.info(f"正在发送本地图片.. {path}")
                 if os.path.exists(path):
-                    # 转换为 base64 发送
-                    b64_data = _image_to_base64(path)
-                    ctx.add_return('reply', MessageChain([Image(base64=b64_data)]))
+                    ctx.add_return('reply', MessageChain([self._image_for(ctx.event, path)]))
                 else:
                     ctx.add_return('reply', MessageChain([Plain(f"图片文件不存在: {path}")]))
             except Exception as e:
                 await ctx.send_message(ctx.event.launcher_type, str(ctx.event.launcher_id), MessageChain([f"发生了一个错误：{e}"]))
             return
 
-        # 5) 默认：直接回传文本
+        # 4) 默认：直接回传文本
         return ctx.add_return('reply', message)
 
     def __del__(self):
@@ -416,10 +717,61 @@ class Fct(BasePlugin):
         prompt = m.group(1).strip()
         if not prompt:
             return ctx.add_return('reply', MessageChain([Plain('请输入绘图描述，例如 /p 一只在月球上的猫')]))
+        if not self._accepting:
+            return ctx.add_return('reply', MessageChain([Plain('插件正在重启，请稍后再试')]))
+
+        # 限流：本地模式下被拒绝时不做任何网络/文件 I/O，直接友好回复
+        decision = self._limiter.check(
+            getattr(ctx.event, 'launcher_type', None),
+            getattr(ctx.event, 'launcher_id', None),
+            getattr(ctx.event, 'sender_id', None),
+        )
+        if not decision.allowed:
+            return ctx.add_return('reply', MessageChain([Plain(decision.message)]))
+
+        # 在独立任务中执行，destroy() 排空时等待其完成，超时则取消（任务日志中保持 accepted，下次启动重放）
+        task = asyncio.ensure_future(self._run_prompt(ctx, prompt, prefix))
+        self._live_tasks.add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task.cancelled() and not self._accepting:
+                return None
+            raise
+        finally:
+            self._live_tasks.discard(task)
 
+    async def _run_prompt(self, ctx: EventContext, prompt: str, prefix: str):
+        await self._ensure_ready()
         cfg = self.config
         openrouter_cfg = cfg.get('openrouter', {})
         fallback_cfg = cfg.get('fallback', {})
+        edit_cfg = cfg.get('edit', {}) or {}
+
+        # 图生图：消息（含被回复的消息）中带图时，作为参考图一并发送给模型
+        input_images = None
+        if edit_cfg.get('enabled', True):
+            refs = extract_images(getattr(ctx.event, 'message_chain', None), limit=int(edit_cfg.get('max_images') or 3))
+            if refs:
+                try:
+                    input_images = await self._ref_images.prepare(refs)
+                    self.ap.logger.info(f"{prefix} 检测到 {len(input_images)} 张参考图，使用图生图模式")
+                except Exception as e:
+                    self.ap.logger.warning(f"读取参考图失败: {e}")
+                    return ctx.add_return('reply', MessageChain([Plain(f"读取参考图失败：{e}")]))
+        # 图生图不查结果缓存：只推迟预取，不计入频率统计与命中率
+        self._prefetcher.note_live(None if input_images else prompt, openrouter_cfg.get('model'))
+        launcher_type = getattr(ctx.event, 'launcher_type', None)
+        job_id = self._journal.accepted(
+            prompt=prompt,
+            model=openrouter_cfg.get('model') or None,
+            platform=platform_of(ctx.event),
+            launcher_type=str(getattr(launcher_type, 'value', launcher_type) or ''),
+            launcher_id=str(getattr(ctx.event, 'launcher_id', '')),
+            sender_id=str(getattr(ctx.event, 'sender_id', '')),
+            edit=bool(input_images),
+        )
+
         # 使用在 __init__ 中标准化后的绝对路径；若缺失则退回到当前文件同目录 generated
         configured_dir = cfg.get('storage', {}).get('output_dir')
         if not configured_dir:
@@ -437,27 +789,6 @@ class Fct(BasePlugin):
         except Exception:
             pass
 
-        # Helper to robustly extract API key from config/root/env
-        def _get_api_key(openrouter_dict, root_cfg=self.config):
-            import os as _os
-            # 1) check openrouter section
-            if isinstance(openrouter_dict, dict):
-                for k in ("api_key", "apikey", "apiKey", "key", "token", "OPENROUTER_API_KEY"):
-                    v = openrouter_dict.get(k)
-                    if isinstance(v, str) and v.strip():
-                        return v.strip()
-            # 2) check root-level fallbacks
-            if isinstance(root_cfg, dict):
-                for k in ("openrouter_api_key", "OPENROUTER_API_KEY", "api_key", "apiKey", "apikey", "key", "token"):
-                    v = root_cfg.get(k)
-                    if isinstance(v, str) and v.strip():
-                        return v.strip()
-            # 3) environment
-            v = _os.getenv("OPENROUTER_API_KEY")
-            if isinstance(v, str) and v.strip():
-                return v.strip()
-            return None
-
         if openrouter_cfg.get('enabled', True):
             try:
                 # 确保输出目录存在
@@ -465,34 +796,76 @@ class Fct(BasePlugin):
                 filename = f"drawer_{uuid.uuid4().hex}.png"
                 out_path = os.path.join(out_dir, filename)
                 try:
-                    key_for_call = (_get_api_key(openrouter_cfg) or None)
-                    masked = (key_for_call[:4] + '***' + key_for_call[-4:]) if isinstance(key_for_call, str) and len(key_for_call) >= 8 else str(bool(key_for_call))
-                    self._logger.info(f"Call generate_image_with_openrouter prompt_len={len(prompt)} model={openrouter_cfg.get('model')} out_path={out_path} api_key={masked}")
+                    # file log what we will call
+                    self._logger.info(f"Call generate_image_result prompt_len={len(prompt)} model={openrouter_cfg.get('model')} out_path={out_path} keys={len(self._key_pool)}")
                 except Exception:
                     pass
-                img_path = await generate_image_with_openrouter(
-                    prompt,
-                    out_path=out_path,
-                    site_url=(openrouter_cfg.get('site_url') or None),
-                    site_title=(openrouter_cfg.get('site_title') or None),
-                    model=openrouter_cfg.get('model', 'google/gemini-2.5-flash-image-preview:free') or 'google/gemini-2.5-flash-image-preview:free',
-                    api_key=(_get_api_key(openrouter_cfg) or None),
-                )
-                self.ap.logger.info(f"{prefix} 生成完成，发送本地图片: {img_path}")
-                # 转换为 base64 发送，避免路径识别问题
-                with open(img_path, 'rb') as f:
-                    img_data = f.read()
-                    b64_data = base64.b64encode(img_data).decode('utf-8')
-                return ctx.add_return('reply', MessageChain([Image(base64=b64_data)]))
+                model = openrouter_cfg.get('model', 'google/gemini-2.5-flash-image-preview:free') or 'google/gemini-2.5-flash-image-preview:free'
+                # 渐进式发送：图片字节一到就在工作进程里生成缩略图发出去，与完整图的发送并行
+                started = asyncio.get_running_loop().time()
+                preview_tasks = []
+                full_sent = asyncio.Event()
+                on_image = None
+                if self._previews is not None and platform_enabled(self._preview_platforms, platform_of(ctx.event)):
+                    def on_image(data: bytes):
+                        if len(data) >= self._preview_min_bytes:
+                            preview_tasks.append(asyncio.ensure_future(self._send_preview(ctx, data, started, full_sent)))
+                native_image = self._supports_image_output(model)
+
+                async def _generate():
+                    async with self._adaptive.slot('openrouter', model) as deadline:
+                        return await generate_image_result(
+                            prompt,
+                            out_path=out_path,
+                            site_url=(openrouter_cfg.get('site_url') or None),
+                            site_title=(openrouter_cfg.get('site_title') or None),
+                            model=model,
+                            key_pool=self._key_pool,
+                            input_images=input_images,
+                            timeout=deadline,
+                            native_image=native_image,
+                            on_image=on_image,
+                        )
+
+                if input_images:
+                    result = await _generate()
+                else:
+                    # 文生图：命中缓存（含其他进程生成的）直接发送；相同请求进行中时等待其结果
+                    result, cached = await self._cache.get_or_generate(
+                        self._cache.key(model, prompt, native_image), _generate, model=model, prompt=prompt,
+                    )
+                    if cached:
+                        self.ap.logger.info(f"{prefix} 命中生成缓存: {result.path}")
+                self.ap.logger.info(f"{prefix} 生成完成，发送本地图片: {result.path}")
+                self._journal.done(job_id, path=result.path)
+                if preview_tasks and self._preview_max_wait > 0:
+                    # 可选：让完整图最多等待预览 max_wait 秒（仅在 bench_preview.py 实测有益时开启）
+                    await asyncio.wait(preview_tasks, timeout=self._preview_max_wait)
+                # 直接用内存中的图片数据（或签名链接）发送，无需回读文件
+                reply = MessageChain([self._image_for(ctx.event, result.path, result.data)])
+                # 发送失败不应触发回退：_deliver 自行处理异常
+                await self._deliver(ctx, job_id, reply)
+                full_sent.set()
+                self._record_timing('full_image', started)
+                return
             except Exception as e:
+                if not self._accepting:
+                    # 正在退出（连接池可能已关闭）：不回退、不写入终态，任务保持 accepted，下次启动时重放
+                    self.ap.logger.warning(f"{prefix} 插件退出中生成中断，将在下次启动时重放: {e}")
+                    return
                 self.ap.logger.warning(f"OpenRouter 生成失败，准备回退: {e}")
                 try:
                     self._logger.warning("OpenRouter failed, will fallback: %s", e)
                 except Exception:
                     pass
 
+        # pollinations 不支持参考图，图生图失败时不回退
+        if input_images:
+            self._journal.failed(job_id, 'edit failed')
+            return ctx.add_return('reply', MessageChain([Plain('图生图失败，请稍后重试')]))
         if fallback_cfg.get('enabled', True):
             url = "https://image.pollinations.ai/prompt/" + prompt
-            return ctx.add_return('reply', MessageChain([Image(url=url)]))
+            return await self._deliver(ctx, job_id, MessageChain([Image(url=url)]), provider='pollinations')
         else:
+            self._journal.failed(job_id, 'fallback disabled')
             return ctx.add_return('reply', MessageChain([Plain('生成失败，且已禁用回退')]))
@@ -0,0 +1,39 @@
+import time
+import threading
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry: monotonic counters plus last-value gauges.
+
+    Names are dotted strings (``adaptive.openrouter/model.limit``); ``snapshot`` returns a
+    plain dict that can be logged or dumped as JSON.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._started = time.time()
+
+    def incr(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name: str, default: float = 0) -> float:
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name]
+            return self._gauges.get(name, default)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_s": round(time.time() - self._started, 1),
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+            }
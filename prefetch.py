@@ -0,0 +1,211 @@
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+
+
+_log = logging.getLogger("AIDrawing")
+
+_DEFAULTS = {
+    "interval": 60.0,          # 两次检查之间的间隔（秒）
+    "top_n": 20,               # 只在得分最高的 N 条提示词中挑选
+    "min_count": 3,            # 至少出现过这么多次（按衰减后得分）才预取
+    "calls_per_hour": 10,      # 预取调用预算
+    "quiet_seconds": 30.0,     # 最近一次实时请求之后至少空闲这么久
+    "half_life_days": 7.0,     # 使用频率的衰减半衰期
+    "max_tracked": 500,        # 最多记录的不同提示词数
+    "retry_after": 3600.0,     # 预取失败的提示词在此时间内不再尝试
+}
+
+
+class PromptStats:
+    """
+    Decayed usage counts of /p prompts, persisted as JSON under data/ so the history survives
+    restarts. Each use adds 1 to a score that halves every ``half_life_days``.
+    """
+
+    def __init__(self, path: str | None, *, half_life_days: float = 7.0, max_tracked: int = 500):
+        self.path = path
+        self.half_life = max(1.0, half_life_days * 86400.0)
+        self.max_tracked = max(1, int(max_tracked))
+        self._items: dict[str, dict] = {}
+        self._dirty = False
+        self._load()
+
+    def _decayed(self, item: dict, now: float) -> float:
+        return item["score"] * math.pow(0.5, max(0.0, now - item["ts"]) / self.half_life)
+
+    def record(self, prompt: str, model: str | None = None) -> None:
+        prompt = prompt.strip()
+        if not prompt:
+            return
+        now = time.time()
+        item = self._items.get(prompt)
+        score = self._decayed(item, now) if item else 0.0
+        self._items[prompt] = {"score": score + 1.0, "ts": now, "model": model}
+        self._dirty = True
+        if len(self._items) > self.max_tracked:
+            # 淘汰得分最低的条目
+            worst = min(self._items, key=lambda p: self._decayed(self._items[p], now))
+            del self._items[worst]
+
+    def top(self, n: int, min_score: float = 0.0) -> list[tuple[str, float, str | None]]:
+        now = time.time()
+        scored = [(p, self._decayed(it, now), it.get("model")) for p, it in self._items.items()]
+        scored = [x for x in scored if x[1] >= min_score]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:n]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for p, it in (data.get("prompts") or {}).items():
+                self._items[str(p)] = {"score": float(it["score"]), "ts": float(it["ts"]), "model": it.get("model")}
+        except Exception as e:
+            _log.warning("Failed to load prompt stats %s: %s", self.path, e)
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        try:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"prompts": self._items}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._dirty = False
+        except Exception as e:
+            _log.warning("Failed to persist prompt stats %s: %s", self.path, e)
+
+
+class Prefetcher:
+    """
+    Background task that pre-renders the most frequent /p prompts into the GenerationCache.
+
+    A call is made only when the provider is idle (no live call running or queued, see
+    ``AdaptiveRegistry.idle``), no live request arrived in the last ``quiet_seconds``, and the
+    hourly budget has room. At most one prefetch runs at a time.
+
+    ``generate(prompt, model)`` is an async callable returning an ImageResult; ``model_for(model)``
+    maps a recorded model (or None) to the model to render with now.
+    """
+
+    def __init__(self, cfg: dict | None, *, stats: PromptStats, cache, adaptive, generate,
+                 model_for, native_for, metrics=None):
+        cfg = cfg if isinstance(cfg, dict) else {}
+        self.enabled = bool(cfg.get("enabled", False))
+        self.cfg = {**_DEFAULTS, **{k: v for k, v in cfg.items() if k in _DEFAULTS}}
+        self.stats = stats
+        self.cache = cache
+        self.adaptive = adaptive
+        self.generate = generate
+        self.model_for = model_for
+        self.native_for = native_for
+        self.metrics = metrics
+        self._calls: deque[float] = deque()
+        self._failed: dict[str, float] = {}
+        self._last_live = 0.0
+        self._task: asyncio.Task | None = None
+
+    def note_live(self, prompt: str | None = None, model: str | None = None) -> None:
+        """
+        实时请求到达：推迟预取。只有会查结果缓存的文生图 /p 才传入 ``prompt``，
+        此时记录提示词频率并计入 hit_rate 的分母 prefetch.live_requests
+        """
+        self._last_live = time.monotonic()
+        if not self.enabled or not prompt:
+            return
+        if self.metrics is not None:
+            self.metrics.incr("prefetch.live_requests")
+        self.stats.record(prompt, model)
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+            self._task = None
+        self.stats.save()
+
+    def _budget_left(self, now: float) -> int:
+        while self._calls and now - self._calls[0] > 3600.0:
+            self._calls.popleft()
+        return int(self.cfg["calls_per_hour"]) - len(self._calls)
+
+    def _candidate(self, now: float):
+        for prompt, score, recorded_model in self.stats.top(int(self.cfg["top_n"]), float(self.cfg["min_count"])):
+            if now - self._failed.get(prompt, -math.inf) < float(self.cfg["retry_after"]):
+                continue
+            model = self.model_for(recorded_model)
+            key = self.cache.key(model, prompt, self.native_for(model))
+            if not self.cache.contains(key):
+                return prompt, model, key
+        return None
+
+    def _publish(self) -> None:
+        if self.metrics is None:
+            return
+        m = self.metrics
+        hits, live, generated = m.get("prefetch.hits"), m.get("prefetch.live_requests"), m.get("prefetch.generated")
+        m.gauge("prefetch.budget_left", self._budget_left(time.monotonic()))
+        m.gauge("prefetch.tracked_prompts", len(self.stats))
+        # hit_rate：实时 /p 请求中由预取结果直接满足的比例；hits_per_call：每次预取调用平均被命中几次
+        if live:
+            m.gauge("prefetch.hit_rate", round(hits / live, 3))
+        if generated:
+            m.gauge("prefetch.hits_per_call", round(hits / generated, 3))
+
+    async def tick(self) -> bool:
+        """尝试预取一条；返回是否发起了调用"""
+        now = time.monotonic()
+        if self._budget_left(now) <= 0 or now - self._last_live < float(self.cfg["quiet_seconds"]):
+            return False
+        picked = self._candidate(now)
+        if picked is None:
+            return False
+        prompt, model, key = picked
+        if not self.adaptive.idle("openrouter", model):
+            return False
+        self._calls.append(now)
+        try:
+            _, cached = await self.cache.get_or_generate(
+                key, lambda: self.generate(prompt, model), model=model, prompt=prompt, prefetched=True,
+            )
+            if not cached and self.metrics is not None:
+                self.metrics.incr("prefetch.generated")
+            _log.info("Prefetched prompt (len=%d, model=%s)", len(prompt), model)
+        except Exception as e:
+            self._failed[prompt] = now
+            if self.metrics is not None:
+                self.metrics.incr("prefetch.errors")
+            _log.info("Prefetch failed for prompt (len=%d): %s", len(prompt), e)
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(float(self.cfg["interval"]))
+            try:
+                await self.tick()
+                self.stats.save()
+                self._publish()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _log.warning("Prefetch loop error: %s", e)
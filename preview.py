@@ -0,0 +1,70 @@
+import io
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+_log = logging.getLogger("AIDrawing")
+
+
+def make_thumbnail(data: bytes, max_side: int = 320, quality: int = 70) -> bytes | None:
+    """Downscale ``data`` to a small JPEG preview; runs in a worker process. None without Pillow."""
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        return None
+    with PILImage.open(io.BytesIO(data)) as im:
+        im.draft("RGB", (max_side, max_side))  # JPEG 输入可直接按比例解码，省去全尺寸解码
+        im = im.convert("RGB")
+        im.thumbnail((max_side, max_side), PILImage.BILINEAR)
+        buf = io.BytesIO()
+        im.save(buf, format="JPEG", quality=quality)
+        return buf.getvalue()
+
+
+def _noop() -> None:
+    return None
+
+
+def _mp_context():
+    """宿主进程中已有多个线程，fork 可能复制持有中的锁导致子进程死锁：优先 forkserver，其次 spawn"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class ThumbnailWorker:
+    """
+    Builds low-resolution previews in a single worker process, so decoding a large image
+    never stalls the bot's event loop. Falls back to a thread if processes are unavailable.
+    """
+
+    def __init__(self, *, max_side: int = 320, quality: int = 70):
+        self.max_side = max_side
+        self.quality = quality
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=_mp_context(),
+                )
+            except Exception as e:
+                _log.warning("Process pool unavailable for previews, using a thread: %s", e)
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aidrawing-preview")
+        return self._executor
+
+    async def warm(self) -> None:
+        """Start the worker process ahead of the first preview."""
+        await asyncio.get_running_loop().run_in_executor(self._get_executor(), _noop)
+
+    async def thumbnail(self, data: bytes) -> bytes | None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), make_thumbnail, data, self.max_side, self.quality)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import logging
+from dataclasses import dataclass
+
+
+_log = logging.getLogger("AIDrawing")
+
+# 默认限额：会话（群/私聊）与会话内单个发送者各一个令牌桶，外加每日配额
+_DEFAULT_LIMITS = {
+    "session": {"capacity": 6, "refill_per_minute": 3, "daily_quota": 200},
+    "user": {"capacity": 2, "refill_per_minute": 1, "daily_quota": 30},
+}
+
+
+def session_key(launcher_type, launcher_id) -> str:
+    """将 launcher_type/launcher_id 规范为形如 group_123456 的键（与 config.json 中 groups 的键一致）"""
+    lt = getattr(launcher_type, "value", launcher_type)
+    return f"{lt or 'unknown'}_{launcher_id if launcher_id is not None else ''}"
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    reason: str = ""
+    retry_after: float = 0.0
+    message: str = ""
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = float(capacity)
+        self.rate = float(rate)  # tokens per second
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def peek(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1.0
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def retry_after(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1.0 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    In-memory token-bucket limiter keyed on session (launcher_type/launcher_id) and sender.
+
+    Decisions are made purely from memory; the daily quota counters are only written
+    to ``state_path`` when a request is accepted, so a rejection costs no I/O.
+
+    With a shared ``backend`` (see shared.py) the token buckets and daily quotas live in the
+    backend and every decision is one ``Backend.admit`` transaction, so all processes on the
+    host share the same burst, refill and quota limits. The in-memory counters then only
+    mirror the last shared values; a quota they already show as used up is rejected without
+    touching the backend. If the backend fails, the limiter falls back to in-memory limits.
+    """
+
+    def __init__(self, cfg: dict | None, state_path: str | None = None, backend=None):
+        cfg = cfg if isinstance(cfg, dict) else {}
+        self.enabled = bool(cfg.get("enabled", True))
+        self._limits = {
+            scope: {**_DEFAULT_LIMITS[scope], **(cfg.get(scope) or {})}
+            for scope in _DEFAULT_LIMITS
+        }
+        groups = cfg.get("groups") or {}
+        self._overrides = {str(k): v for k, v in groups.items() if isinstance(v, dict)}
+        self._state_path = state_path
+        self._backend = backend if backend is not None and getattr(backend, "shared", False) else None
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._day = self._today()
+        self._used: dict[str, int] = {}
+        self._load()
+
+    @staticmethod
+    def _today() -> str:
+        return time.strftime("%Y-%m-%d")
+
+    def _limits_for(self, skey: str, scope: str) -> dict:
+        base = self._limits[scope]
+        override = (self._overrides.get(skey) or {}).get(scope)
+        return {**base, **override} if isinstance(override, dict) else base
+
+    def _bucket(self, key: tuple[str, str], limits: dict, now: float) -> TokenBucket:
+        b = self._buckets.get(key)
+        if b is None:
+            rate = float(limits.get("refill_per_minute") or 0) / 60.0
+            b = TokenBucket(limits.get("capacity") or 1, rate, now)
+            self._buckets[key] = b
+        return b
+
+    def _roll_day(self) -> None:
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._used.clear()
+
+    def check(self, launcher_type, launcher_id, sender_id) -> Decision:
+        """判定并（在放行时）扣减令牌与当日配额"""
+        if not self.enabled:
+            return Decision(True)
+        now = time.monotonic()
+        self._roll_day()
+        skey = session_key(launcher_type, launcher_id)
+        ukey = f"{skey}:{sender_id}"
+        s_lim = self._limits_for(skey, "session")
+        u_lim = self._limits_for(skey, "user")
+
+        # 1) 每日配额（纯内存计数；共享模式下为共享计数的下界，已用完即可直接拒绝）
+        for key, lim in ((ukey, u_lim), (skey, s_lim)):
+            quota = lim.get("daily_quota")
+            if quota is not None and quota >= 0 and self._used.get(key, 0) >= quota:
+                return self._quota_denied(quota)
+
+        if self._backend is not None:
+            try:
+                return self._check_shared((("user", ukey, u_lim), ("session", skey, s_lim)))
+            except Exception as e:
+                # 共享后端不可用时不阻塞绘图，退回本进程限流
+                _log.warning("Shared rate-limit backend failed, limiting locally: %s", e)
+
+        # 2) 令牌桶：两个桶都有令牌才放行，避免只扣一个
+        s_bucket = self._bucket(("session", skey), s_lim, now)
+        u_bucket = self._bucket(("user", ukey), u_lim, now)
+        if not (s_bucket.peek(now) and u_bucket.peek(now)):
+            return self._rate_denied(max(s_bucket.retry_after(now), u_bucket.retry_after(now)))
+
+        self._used[ukey] = self._used.get(ukey, 0) + 1
+        self._used[skey] = self._used.get(skey, 0) + 1
+        if self._backend is None:
+            self._save()
+        s_bucket.take(now)
+        u_bucket.take(now)
+        return Decision(True)
+
+    def _check_shared(self, scopes) -> Decision:
+        """令牌桶与当日配额在共享后端的同一个事务中判定并扣减，所有进程共用同一份限额"""
+        buckets = [
+            (f"bucket:{scope}:{key}", float(lim.get("capacity") or 1), float(lim.get("refill_per_minute") or 0) / 60.0)
+            for scope, key, lim in scopes
+        ]
+        quotas = [(f"quota:{self._day}:{key}", lim.get("daily_quota")) for _, key, lim in scopes]
+        verdict, counts = self._backend.admit(buckets, quotas, ttl=2 * 86400)
+        for (_, key, _), (name, _) in zip(scopes, quotas):
+            if name in counts:
+                self._used[key] = counts[name]
+        if verdict is None:
+            return Decision(True)
+        if verdict[0] == "quota":
+            return self._quota_denied(quotas[verdict[1]][1])
+        return self._rate_denied(verdict[1])
+
+    @staticmethod
+    def _quota_denied(quota) -> Decision:
+        return Decision(False, "quota", message=f"今日绘图次数已用完（{quota} 次），明天再来吧~")
+
+    @staticmethod
+    def _rate_denied(wait: float) -> Decision:
+        secs = int(wait) + 1 if wait != float("inf") else None
+        msg = f"画得太快啦，请 {secs} 秒后再试~" if secs else "当前会话暂不允许绘图"
+        return Decision(False, "rate", retry_after=wait, message=msg)
+
+    def usage(self, launcher_type, launcher_id, sender_id=None) -> dict:
+        """返回当日已用配额，供日志/统计使用"""
+        self._roll_day()
+        skey = session_key(launcher_type, launcher_id)
+        out = {"day": self._day, "session": self._count(skey)}
+        if sender_id is not None:
+            out["user"] = self._count(f"{skey}:{sender_id}")
+        return out
+
+    def _count(self, key: str) -> int:
+        if self._backend is not None:
+            try:
+                return self._backend.get_counter(f"quota:{self._day}:{key}")
+            except Exception:
+                pass
+        return self._used.get(key, 0)
+
+    def _load(self) -> None:
+        if self._backend is not None:
+            return
+        if not self._state_path or not os.path.exists(self._state_path):
+            return
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get("day") == self._day:
+                used = data.get("used") or {}
+                self._used = {str(k): int(v) for k, v in used.items()}
+        except Exception as e:
+            _log.warning("Failed to load rate-limit state %s: %s", self._state_path, e)
+
+    def _save(self) -> None:
+        if not self._state_path:
+            return
+        try:
+            d = os.path.dirname(self._state_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            tmp = self._state_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"day": self._day, "used": self._used}, f, ensure_ascii=False)
+            os.replace(tmp, self._state_path)
+        except Exception as e:
+            _log.warning("Failed to persist rate-limit state %s: %s", self._state_path, e)
@@ -0,0 +1,74 @@
+import time
+import secrets
+from collections import OrderedDict
+
+
+class ResultRegistry:
+    """
+    Per-conversation handoff of generation results from the Drawer llm_func to convert_message.
+    The caller picks the conversation key; the plugin uses launcher plus sender, so in a group
+    one member's reply never picks up another member's image.
+
+    Drawer stores the result under a short opaque token and only the token goes into the text
+    the LLM sees; convert_message resolves it with a dict lookup. Entries expire after ``ttl``
+    seconds and the registry never holds more than ``max_entries`` results.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (conversation, token) -> (expires_at, result), oldest first
+        self._entries: "OrderedDict[tuple[str, str], tuple[float, object]]" = OrderedDict()
+        self._by_conv: dict[str, list[str]] = {}
+
+    @staticmethod
+    def marker(token: str) -> str:
+        return f"[img:{token}]"
+
+    def _purge(self, now: float) -> None:
+        while self._entries:
+            key, (expires, _) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) <= self.max_entries:
+                break
+            self._drop(key)
+
+    def _drop(self, key: tuple[str, str]) -> None:
+        self._entries.pop(key, None)
+        tokens = self._by_conv.get(key[0])
+        if tokens is not None:
+            try:
+                tokens.remove(key[1])
+            except ValueError:
+                pass
+            if not tokens:
+                del self._by_conv[key[0]]
+
+    def put(self, conversation: str, result) -> str:
+        now = time.monotonic()
+        token = secrets.token_hex(4)
+        self._entries[(conversation, token)] = (now + self.ttl, result)
+        self._by_conv.setdefault(conversation, []).append(token)
+        self._purge(now)
+        return token
+
+    def pop(self, conversation: str, token: str):
+        entry = self._entries.get((conversation, token))
+        if entry is None:
+            return None
+        self._drop((conversation, token))
+        expires, result = entry
+        return result if expires > time.monotonic() else None
+
+    def take_for(self, conversation: str, text: str) -> list:
+        """
+        Pop the results this reply refers to: entries whose token appears in ``text``, or,
+        if the LLM dropped every token, the most recent pending entry of the same conversation
+        (same launcher and sender).
+        """
+        tokens = self._by_conv.get(conversation)
+        if not tokens:
+            return []
+        self._purge(time.monotonic())
+        tokens = list(self._by_conv.get(conversation) or ())
+        matched = [t for t in tokens if t in text] or tokens[-1:]
+        return [r for r in (self.pop(conversation, t) for t in matched) if r is not None]
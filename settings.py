@@ -0,0 +1,68 @@
+import os
+import json
+import copy
+
+
+try:
+    PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+except Exception:
+    PLUGIN_DIR = os.getcwd()
+
+CONFIG_PATH = os.path.join(PLUGIN_DIR, "config.json")
+
+DEFAULT_CONFIG = {
+    "command_prefix": "/p",
+    "openrouter": {
+        "enabled": True,
+        "model": "google/gemini-2.5-flash-image-preview:free",
+        "api_key": "",
+        "site_url": "",
+        "site_title": "",
+    },
+    "storage": {"output_dir": "generated"},
+    "fallback": {"enabled": True, "provider": "pollinations"},
+    "rate_limit": {"enabled": True},
+    "edit": {"enabled": True, "max_images": 3, "max_side": 1536, "max_bytes": 3000000},
+    "warmup": {"enabled": True, "preconnect": True, "timeout": 10},
+    "adaptive": {"enabled": True},
+    "results": {"ttl": 600, "max_entries": 256},
+    "server": {"enabled": False},
+    "preview": {"enabled": False},
+    "shared": {"backend": "local", "cache": False},
+    "prefetch": {"enabled": False},
+    "journal": {"drain_timeout": 30, "max_age": 1800},
+}
+
+
+def default_config() -> dict:
+    return copy.deepcopy(DEFAULT_CONFIG)
+
+
+def merge(dst: dict, src: dict) -> dict:
+    """递归合并：src 中的 dict 合并进 dst 对应的 dict，其余值直接覆盖"""
+    for k, v in src.items():
+        if isinstance(v, dict) and isinstance(dst.get(k), dict):
+            merge(dst[k], v)
+        else:
+            dst[k] = v
+    return dst
+
+
+def load_config(cfg_path: str | None = None) -> dict:
+    """Defaults merged with ``cfg_path`` (plugin config.json by default). Raises if the file is invalid."""
+    cfg = default_config()
+    cfg_path = cfg_path or CONFIG_PATH
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r", encoding="utf-8") as f:
+            merge(cfg, json.load(f))
+    return cfg
+
+
+def resolve_output_dir(cfg: dict, base_dir: str = PLUGIN_DIR) -> str:
+    """将 storage.output_dir 的相对路径固定到 base_dir 下，回写到 cfg 并返回绝对路径"""
+    storage_cfg = cfg.get("storage") if isinstance(cfg.get("storage"), dict) else {}
+    raw_out_dir = storage_cfg.get("output_dir") or "generated"
+    out_dir = raw_out_dir if os.path.isabs(raw_out_dir) else os.path.join(base_dir, raw_out_dir)
+    if isinstance(cfg.get("storage"), dict):
+        cfg["storage"]["output_dir"] = out_dir
+    return out_dir
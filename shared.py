@@ -0,0 +1,406 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+
+_log = logging.getLogger("AIDrawing")
+
+
+class Backend:
+    """
+    Storage shared by every bot process using this plugin: the generation result cache,
+    in-flight claims (cross-process deduplication), counters and rate-limit state (token
+    buckets plus daily quotas, see ``admit``).
+
+    Calls are synchronous and expected to be sub-millisecond (local SQLite / local Redis).
+    """
+
+    shared = False
+
+    def cache_get(self, key: str) -> dict | None:
+        raise NotImplementedError
+
+    def cache_put(self, key: str, value: dict, ttl: float) -> None:
+        raise NotImplementedError
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """Take the in-flight claim for ``key``; False if another live owner holds it."""
+        raise NotImplementedError
+
+    def release(self, key: str, owner: str) -> None:
+        raise NotImplementedError
+
+    def incr(self, name: str, amount: int = 1, ttl: float | None = None) -> int:
+        """Atomically add ``amount`` to a counter and return the new value."""
+        raise NotImplementedError
+
+    def get_counter(self, name: str) -> int:
+        raise NotImplementedError
+
+    def admit(self, buckets, quotas, ttl: float):
+        """
+        Rate-limit decision in one atomic step. ``buckets`` is a list of ``(name, capacity,
+        refill_per_second)`` token buckets, ``quotas`` a list of ``(counter_name, limit)``
+        (limit None or negative = unlimited). If every quota has room and every bucket holds a
+        token, take one token from each bucket and add 1 to each counter.
+
+        Returns ``(verdict, counts)``: verdict is None when admitted, ``("quota", index)`` or
+        ``("rate", seconds_to_wait)`` otherwise; counts maps the counters read to their value.
+        Bucket state and new counters expire after ``ttl`` seconds.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def _decide(buckets, quotas, now: float, bucket_state, counter_value):
+    """
+    ``admit`` rule shared by the Python backends: ``bucket_state(name)`` returns
+    ``(tokens, updated)`` or None (a full bucket), ``counter_value(name)`` the current count.
+    Returns ``(verdict, counts, bucket_updates)``.
+    """
+    counts = {}
+    for i, (name, limit) in enumerate(quotas):
+        counts[name] = counter_value(name)
+        if limit is not None and limit >= 0 and counts[name] >= limit:
+            return ("quota", i), counts, {}
+    wait = 0.0
+    updates = {}
+    for name, capacity, rate in buckets:
+        tokens, updated = bucket_state(name) or (capacity, now)
+        if now > updated:
+            tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens < 1.0:
+            wait = max(wait, (1.0 - tokens) / rate if rate > 0 else float("inf"))
+        updates[name] = tokens - 1.0
+    if wait > 0:
+        return ("rate", wait), counts, {}
+    return None, counts, updates
+
+
+class LocalBackend(Backend):
+    """Process-local default: nothing is shared, behaviour matches a single bot instance."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: dict[str, tuple[float, dict]] = {}
+        self._claims: dict[str, tuple[str, float]] = {}
+        self._counters: dict[str, tuple[int, float | None]] = {}
+        self._buckets: dict[str, tuple[float, float, float]] = {}
+
+    def cache_get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._cache[key]
+                return None
+            return entry[1]
+
+    def cache_put(self, key, value, ttl):
+        with self._lock:
+            self._cache[key] = (time.time() + ttl, value)
+
+    def claim(self, key, owner, ttl):
+        now = time.time()
+        with self._lock:
+            held = self._claims.get(key)
+            if held is not None and held[0] != owner and held[1] > now:
+                return False
+            self._claims[key] = (owner, now + ttl)
+            return True
+
+    def release(self, key, owner):
+        with self._lock:
+            if self._claims.get(key, (None,))[0] == owner:
+                del self._claims[key]
+
+    def incr(self, name, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            value, expires = self._counters.get(name, (0, None))
+            if expires is not None and expires < now:
+                value = 0
+            value += amount
+            self._counters[name] = (value, now + ttl if ttl else expires)
+            return value
+
+    def get_counter(self, name):
+        with self._lock:
+            value, expires = self._counters.get(name, (0, None))
+            return 0 if expires is not None and expires < time.time() else value
+
+    def admit(self, buckets, quotas, ttl):
+        now = time.time()
+
+        def bucket_state(name):
+            st = self._buckets.get(name)
+            return st[:2] if st is not None and st[2] >= now else None
+
+        def counter_value(name):
+            value, expires = self._counters.get(name, (0, None))
+            return 0 if expires is not None and expires < now else value
+
+        with self._lock:
+            verdict, counts, updates = _decide(buckets, quotas, now, bucket_state, counter_value)
+            if verdict is not None:
+                return verdict, counts
+            for name, tokens in updates.items():
+                self._buckets[name] = (tokens, now, now + ttl)
+            for name, _ in quotas:
+                value, expires = self._counters.get(name, (0, None))
+                if expires is not None and expires < now:
+                    value, expires = 0, None
+                counts[name] = value + 1
+                self._counters[name] = (value + 1, expires if expires is not None else now + ttl)
+            return None, counts
+
+
+class SQLiteBackend(Backend):
+    """
+    SQLite file on a path every process can reach. WAL mode plus ``BEGIN IMMEDIATE`` make
+    claims, counter updates and rate-limit decisions atomic across processes through SQLite's
+    file locking.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, *, busy_timeout: float = 5.0):
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._busy_timeout = busy_timeout
+        with self._tx() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL, expires REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, expires REAL NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _tx(self):
+        backend = self
+
+        class _Tx:
+            def __enter__(self_):
+                self_.db = backend._conn()
+                self_.db.execute("BEGIN IMMEDIATE")
+                return self_.db
+
+            def __exit__(self_, exc_type, exc, tb):
+                self_.db.execute("ROLLBACK" if exc_type else "COMMIT")
+                return False
+
+        return _Tx()
+
+    def cache_get(self, key):
+        row = self._conn().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def cache_put(self, key, value, ttl):
+        with self._tx() as db:
+            db.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                       (key, json.dumps(value, ensure_ascii=False), time.time() + ttl))
+            db.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+
+    def claim(self, key, owner, ttl):
+        now = time.time()
+        with self._tx() as db:
+            row = db.execute("SELECT owner, expires FROM claims WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            db.execute("INSERT OR REPLACE INTO claims (key, owner, expires) VALUES (?, ?, ?)", (key, owner, now + ttl))
+            return True
+
+    def release(self, key, owner):
+        with self._tx() as db:
+            db.execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, owner))
+
+    def incr(self, name, amount=1, ttl=None):
+        now = time.time()
+        with self._tx() as db:
+            row = db.execute("SELECT value, expires FROM counters WHERE name = ?", (name,)).fetchone()
+            value, expires = (row[0], row[1]) if row else (0, None)
+            if expires is not None and expires < now:
+                value = 0
+            value += amount
+            db.execute("INSERT OR REPLACE INTO counters (name, value, expires) VALUES (?, ?, ?)",
+                       (name, value, now + ttl if ttl else expires))
+            return value
+
+    def get_counter(self, name):
+        row = self._conn().execute("SELECT value, expires FROM counters WHERE name = ?", (name,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return 0
+        return int(row[0])
+
+    def admit(self, buckets, quotas, ttl):
+        now = time.time()
+        with self._tx() as db:
+            def bucket_state(name):
+                row = db.execute("SELECT tokens, updated, expires FROM buckets WHERE name = ?", (name,)).fetchone()
+                return (row[0], row[1]) if row is not None and row[2] >= now else None
+
+            def counter_value(name):
+                row = db.execute("SELECT value, expires FROM counters WHERE name = ?", (name,)).fetchone()
+                return 0 if row is None or (row[1] is not None and row[1] < now) else int(row[0])
+
+            verdict, counts, updates = _decide(buckets, quotas, now, bucket_state, counter_value)
+            if verdict is not None:
+                return verdict, counts
+            for name, tokens in updates.items():
+                db.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated, expires) VALUES (?, ?, ?, ?)",
+                           (name, tokens, now, now + ttl))
+            for name, _ in quotas:
+                row = db.execute("SELECT expires FROM counters WHERE name = ?", (name,)).fetchone()
+                expires = row[0] if row is not None and row[0] is not None and row[0] >= now else now + ttl
+                counts[name] += 1
+                db.execute("INSERT OR REPLACE INTO counters (name, value, expires) VALUES (?, ?, ?)",
+                           (name, counts[name], expires))
+            return None, counts
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# KEYS: 配额计数器..., 令牌桶...；ARGV: now, ttl, 配额个数, 各配额上限（-1 不限）, 各桶 capacity/rate
+_ADMIT_LUA = """
+local now, ttl, nq = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local counts = {}
+for i = 1, nq do
+  counts[i] = tonumber(redis.call('GET', KEYS[i]) or '0')
+  local limit = tonumber(ARGV[3 + i])
+  if limit >= 0 and counts[i] >= limit then
+    return {'quota', tostring(i - 1), unpack(counts)}
+  end
+end
+local wait, tokens = 0, {}
+for j = 1, #KEYS - nq do
+  local cap, rate = tonumber(ARGV[2 + nq + 2 * j]), tonumber(ARGV[3 + nq + 2 * j])
+  local st = redis.call('HMGET', KEYS[nq + j], 'tokens', 'ts')
+  local t, ts = tonumber(st[1]) or cap, tonumber(st[2]) or now
+  if now > ts then t = math.min(cap, t + (now - ts) * rate) end
+  if t < 1 then
+    if rate > 0 then wait = math.max(wait, (1 - t) / rate) else wait = math.huge end
+  end
+  tokens[j] = t
+end
+if wait > 0 then
+  return {'rate', tostring(wait), unpack(counts)}
+end
+for j = 1, #KEYS - nq do
+  redis.call('HSET', KEYS[nq + j], 'tokens', tostring(tokens[j] - 1), 'ts', ARGV[1])
+  redis.call('EXPIRE', KEYS[nq + j], ttl)
+end
+for i = 1, nq do
+  counts[i] = redis.call('INCRBY', KEYS[i], 1)
+  if counts[i] == 1 then redis.call('EXPIRE', KEYS[i], ttl) end
+end
+return {'ok', '', unpack(counts)}
+"""
+
+
+class RedisBackend(Backend):
+    """Redis-compatible server (Redis, Valkey, KeyDB...). Needs the optional ``redis`` package."""
+
+    shared = True
+
+    def __init__(self, url: str, *, prefix: str = "aidrawing:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("shared.backend=redis 需要安装 redis 包：pip install redis") from e
+        self._r = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._admit = self._r.register_script(_ADMIT_LUA)
+
+    def _k(self, kind: str, key: str) -> str:
+        return f"{self._prefix}{kind}:{key}"
+
+    def cache_get(self, key):
+        raw = self._r.get(self._k("cache", key))
+        return json.loads(raw) if raw else None
+
+    def cache_put(self, key, value, ttl):
+        self._r.set(self._k("cache", key), json.dumps(value, ensure_ascii=False), ex=max(1, int(ttl)))
+
+    def claim(self, key, owner, ttl):
+        k = self._k("claim", key)
+        if self._r.set(k, owner, nx=True, ex=max(1, int(ttl))):
+            return True
+        held = self._r.get(k)
+        return held is not None and held.decode("utf-8") == owner
+
+    def release(self, key, owner):
+        k = self._k("claim", key)
+        # 仅删除自己持有的 claim
+        self._r.eval(
+            "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0",
+            1, k, owner,
+        )
+
+    def incr(self, name, amount=1, ttl=None):
+        k = self._k("counter", name)
+        value = int(self._r.incrby(k, amount))
+        if ttl and value == amount:
+            # 首次创建时设置过期
+            self._r.expire(k, max(1, int(ttl)))
+        return value
+
+    def get_counter(self, name):
+        raw = self._r.get(self._k("counter", name))
+        return int(raw) if raw else 0
+
+    def admit(self, buckets, quotas, ttl):
+        keys = [self._k("counter", name) for name, _ in quotas] + [self._k("bucket", b[0]) for b in buckets]
+        args = [repr(time.time()), max(1, int(ttl)), len(quotas)]
+        args += [-1 if limit is None else int(limit) for _, limit in quotas]
+        for _, capacity, rate in buckets:
+            args += [repr(float(capacity)), repr(float(rate))]
+        # 脚本在 Redis 内原子执行：返回 [结论, 参数, 各计数...]
+        out = [v.decode("utf-8") if isinstance(v, bytes) else v for v in self._admit(keys=keys, args=args)]
+        counts = {name: int(v) for (name, _), v in zip(quotas, out[2:])}
+        if out[0] == "quota":
+            return ("quota", int(out[1])), counts
+        if out[0] == "rate":
+            return ("rate", float(out[1])), counts
+        return None, counts
+
+    def close(self):
+        try:
+            self._r.close()
+        except Exception:
+            pass
+
+
+def create_backend(cfg: dict | None, base_dir: str) -> Backend:
+    """Build the backend selected by the ``shared`` config section (local / sqlite / redis)."""
+    cfg = cfg if isinstance(cfg, dict) else {}
+    kind = (cfg.get("backend") or "local").lower()
+    if kind == "sqlite":
+        path = cfg.get("path") or "data/shared.sqlite3"
+        path = path if os.path.isabs(path) else os.path.join(base_dir, path)
+        return SQLiteBackend(path)
+    if kind == "redis":
+        return RedisBackend(cfg.get("url") or "redis://127.0.0.1:6379/0", prefix=cfg.get("prefix") or "aidrawing:")
+    if kind != "local":
+        _log.warning("Unknown shared.backend %r, using local", kind)
+    return LocalBackend()
@@ -0,0 +1,92 @@
+"""
+Multi-process checks for the SQLite shared backend: daily quotas, token buckets and in-flight
+claims must hold across processes that share one database file.
+
+    python -m pytest -q test_shared.py
+    python test_shared.py
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shared import SQLiteBackend  # noqa: E402
+
+PROCESSES = 6
+
+
+def _limit_worker(args) -> int:
+    db, n, limits = args
+    from ratelimit import RateLimiter
+
+    limiter = RateLimiter(limits, None, backend=SQLiteBackend(db))
+    return sum(limiter.check("group", 1, f"u{n}_{i}").allowed for i in range(40))
+
+
+def _cache_worker(args) -> list[bool]:
+    db, out_dir = args
+    from cache import GenerationCache
+    from get_image import ImageResult
+
+    async def run():
+        cache = GenerationCache(SQLiteBackend(db), enabled=True, poll_interval=0.05)
+
+        async def produce():
+            await asyncio.sleep(0.5)
+            path = os.path.join(out_dir, f"img_{os.getpid()}.png")
+            with open(path, "wb") as f:
+                f.write(b"\x89PNG\r\n\x1a\n")
+            return ImageResult(path=path, data=b"", mime="image/png")
+
+        key = cache.key("model", "a cat")
+        results = await asyncio.gather(*(cache.get_or_generate(key, produce) for _ in range(3)))
+        return [cached for _, cached in results]
+
+    return asyncio.run(run())
+
+
+def _pool():
+    return mp.get_context("spawn").Pool(PROCESSES)
+
+
+def _allowed(limits) -> int:
+    with tempfile.TemporaryDirectory() as d:
+        db = os.path.join(d, "shared.sqlite3")
+        with _pool() as pool:
+            return sum(pool.map(_limit_worker, [(db, n, limits) for n in range(PROCESSES)]))
+
+
+def test_quota_is_shared_across_processes():
+    # 6 个进程共 240 次请求，会话配额 50：恰好放行 50 次
+    assert _allowed({
+        "session": {"capacity": 1000, "refill_per_minute": 0, "daily_quota": 50},
+        "user": {"capacity": 1000, "refill_per_minute": 0, "daily_quota": 1000},
+    }) == 50
+
+
+def test_bucket_is_shared_across_processes():
+    # 会话突发上限 8、不恢复：所有进程合计只放行 8 次，而不是每个进程 8 次
+    assert _allowed({
+        "session": {"capacity": 8, "refill_per_minute": 0, "daily_quota": 1000},
+        "user": {"capacity": 1000, "refill_per_minute": 0, "daily_quota": 1000},
+    }) == 8
+
+
+def test_claim_dedups_generation_across_processes():
+    with tempfile.TemporaryDirectory() as d:
+        db = os.path.join(d, "shared.sqlite3")
+        with _pool() as pool:
+            flags = pool.map(_cache_worker, [(db, d)] * PROCESSES)
+        generated = sum(not cached for per_proc in flags for cached in per_proc)
+        assert generated == 1
+        assert len([f for f in os.listdir(d) if f.startswith("img_")]) == 1
+
+
+if __name__ == "__main__":
+    test_quota_is_shared_across_processes()
+    test_bucket_is_shared_across_processes()
+    test_claim_dedups_generation_across_processes()
+    print("ok")